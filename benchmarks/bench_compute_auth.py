@@ -0,0 +1,83 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from main04_compute_auth import compute_statement_auth, subnorm_map, strict_modals
+
+# command to run the file in the terminal
+# python benchmarks/bench_compute_auth.py --rows 100000 --repeat 3
+
+def make_pdata_chunk(num_rows, seed=0):
+    """
+    Generates a synthetic chunk of parsed data, drawing subjects, modals, and verbs from the agent and
+    verb dictionaries together with other words.
+
+    Arguments:
+        num_rows: number of statements
+        seed: seed of the random generator
+
+    Returns:
+        DataFrame with the columns of a stage 03 chunk
+    """
+    rng = np.random.default_rng(seed)
+    subjects = sorted(subnorm_map) + ['ele', 'se', 'prazo', 'valor', 'acordo', 'cláusula', 'reajuste', 'hora']
+    modals = sorted(strict_modals) + ['poder', 'pode', 'podem', 'poderá', '']
+    verbs = ['pagar', 'receber', 'ter', 'garantir', 'assegurar', 'proibir', 'permitir', 'conceder', 'fornecer',
+             'trabalhar', 'dispensar', 'reconhecer', 'comprometer', 'obrigar', 'ser', 'estar', 'fazer', 'ficar',
+             'conceder', 'realizar', 'efetuar', 'descontar', 'compensar', 'comunicar', 'apresentar']
+    slem = rng.choice(subjects, num_rows)
+    mlem = rng.choice(modals, num_rows)
+    vlem = rng.choice(verbs, num_rows)
+    return pd.DataFrame({
+        'contract_id': np.char.add('c', (rng.integers(0, num_rows // 100 + 1, num_rows)).astype(str)).astype(object),
+        'subject': slem.astype(object), 'passive': rng.integers(0, 2, num_rows), 'helping_verb': '',
+        'verb': vlem.astype(object), 'vlem': vlem.astype(object), 'modal': mlem.astype(object),
+        'mlem': mlem.astype(object), 'md': (mlem != '').astype(int),
+        'neg': rng.choice(['', 'não'], num_rows, p=[0.9, 0.1]).astype(object), 'slem': slem.astype(object)})
+
+def time_chunk(df, args, repeat):
+    """
+    Times compute_statement_auth on a chunk, keeping the best of several runs.
+
+    Arguments:
+        df: chunk of parsed data
+        args: object containing the required arguments and settings
+        repeat: number of runs
+
+    Returns:
+        tuple of the best time in seconds and the computed DataFrame
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        auth_df = compute_statement_auth(args, df.copy(), "pdata_0.pkl")
+        best = min(best, time.perf_counter() - start)
+    return best, auth_df
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    bench_args = parser.parse_args()
+
+    pd.options.mode.chained_assignment = None
+    df = make_pdata_chunk(bench_args.rows)
+    with tempfile.TemporaryDirectory() as output_directory:
+        os.mkdir(os.path.join(output_directory, "04_auth"))
+        for categorical in [False, True]:
+            chunk = df.astype({column: 'category' for column in ['contract_id', 'slem', 'vlem', 'mlem']}) if categorical else df
+            times = {}
+            results = {}
+            for mode in ['row-wise', 'vectorized', 'keyed']:
+                args = argparse.Namespace(output_directory=output_directory, clause=False, legacy_auth=mode == 'row-wise',
+                                          keyed_auth=mode == 'keyed', lexicon="", pack_flags=False)
+                times[mode], results[mode] = time_chunk(chunk, args, bench_args.repeat)
+                pd.testing.assert_frame_equal(results['row-wise'], results[mode])
+            print(f"{bench_args.rows} rows, {'categorical' if categorical else 'object'} columns: " 
+                  + ", ".join(f"{times[mode]:.3f} s {mode}" for mode in times)
+                  + f" ({times['row-wise'] / times['vectorized']:.1f}x, {times['row-wise'] / times['keyed']:.1f}x)")
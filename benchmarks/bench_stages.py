@@ -0,0 +1,267 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import joblib
+import spacy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from columnar import read_statements
+from lemma_cache import lemma_cache
+from main02_parse_articles import parse_article, parsed_output_path, reparse_article
+from main03_get_parse_data import extract_pdata, list_pdata_chunks, read_pdata_chunk
+from main04_compute_auth import combine_auth, compute_auth_chunks, iter_auth_chunks
+from pipeline import Pipeline
+from synthetic_cbas import generate_corpus, get_se_lemmas
+
+# command to run the file in the terminal, saving the results as a baseline and then checking a change against it
+# python benchmarks/bench_stages.py --docs 1000 10000 --save_baseline baseline.json
+# python benchmarks/bench_stages.py --docs 1000 10000 --baseline baseline.json
+
+# stages that are benchmarked, in pipeline order: 'parse' runs the model and the parsing rules on the contract files,
+# 'rules' reruns the parsing rules on the saved documents of the contracts without a model
+stage_names = ["parse", "rules", "extract", "auth", "aggregate"]
+
+# settings of the run that are stored with the results, since results with other settings are not comparable
+compared_settings = ["sentences", "clause", "model", "rule_engine", "parsed_format", "pdata_format", "jobs",
+                     "pack_flags", "keyed_auth", "skip_auth_combine", "stream_aggregate"]
+
+def get_pipeline_args(directory, bench_args):
+    """
+    Gives the arguments of the pipeline for a benchmark run, with the pipeline's defaults for the settings that
+    are not benchmarked.
+
+    Arguments:
+        directory (str): directory of the run's contract files and outputs
+        bench_args (argparse.Namespace): command-line arguments of the benchmark
+
+    Returns:
+        argparse.Namespace
+    """
+    return argparse.Namespace(
+        input_directory=os.path.join(directory, "input"), output_directory=os.path.join(directory, "output"),
+        clause=bench_args.clause, sentences=bench_args.sentences, seed=bench_args.seed, save_docs=False,
+        rule_engine=bench_args.rule_engine, parsed_format=bench_args.parsed_format, max_chars=100000,
+        pdata_format=bench_args.pdata_format, row_group_size=100000, jobs=bench_args.jobs, legacy_auth=False,
+        keyed_auth=bench_args.keyed_auth, lexicon="", pack_flags=bench_args.pack_flags,
+        skip_auth_combine=bench_args.skip_auth_combine, stream_aggregate=bench_args.stream_aggregate)
+
+def prepare_stage(name, filenames, model, args):
+    """
+    Sets up a stage (e.g. loads the model) and gives a function that runs it, so that the setup is not timed.
+
+    Arguments:
+        name (str): name of the stage
+        filenames (list): names of the contract files
+        model (str): name of the spaCy model used by the parse stage
+        args (argparse.Namespace): arguments of the pipeline
+
+    Returns:
+        function without arguments
+    """
+    if name == "parse":
+        nlp = spacy.load(model, disable=["ner"])
+        return lambda: [parse_article(filename, nlp, args) for filename in filenames]
+    if name == "rules":
+        # the documents are already parsed, so a blank pipeline gives the vocabulary; it has no lemmatizer, so the
+        # verbs the rules re-lemmatize are looked up in the lemma cache
+        nlp = spacy.blank("pt")
+        lemma_cache.lemmas.update(get_se_lemmas())
+        return lambda: [reparse_article(filename, nlp, args) for filename in filenames]
+    if name == "extract":
+        return lambda: extract_pdata(args)
+    if name == "auth":
+        return lambda: (compute_auth_chunks(args), combine_auth(args))
+    return Pipeline(args).aggregate_measures
+
+def count_statements(name, filenames, args):
+    """
+    Counts the statements processed by a stage.
+
+    Arguments:
+        name (str): name of the stage
+        filenames (list): names of the contract files
+        args (argparse.Namespace): arguments of the pipeline
+
+    Returns:
+        int
+    """
+    if name in ["parse", "rules"]:
+        paths = [parsed_output_path(filename, args) for filename in filenames]
+        if args.parsed_format == "arrow":
+            return sum(len(read_statements([path])) for path in paths)
+        return sum(len(joblib.load(path)) for path in paths)
+    if name == "extract":
+        return sum(len(read_pdata_chunk(args, chunk, ['contract_id'])) for chunk in list_pdata_chunks(args))
+    return sum(len(chunk) for chunk in iter_auth_chunks(args, ['contract_id']))
+
+def measure_stage(name, filenames, model, args, connection):
+    """
+    Runs a stage and sends its time, number of statements, and peak memory, or the reason it was skipped.
+    Called in a separate process, so that the peak memory is that of the stage.
+
+    Arguments:
+        name (str): name of the stage
+        filenames (list): names of the contract files
+        model (str): name of the spaCy model used by the parse stage
+        args (argparse.Namespace): arguments of the pipeline
+        connection (multiprocessing.connection.Connection): connection to send the measurements to
+
+    Returns:
+        None
+    """
+    try:
+        run = prepare_stage(name, filenames, model, args)
+    except OSError as e:
+        # e.g. the model is not installed
+        connection.send({'skipped': str(e)})
+        return
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+    # kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    connection.send({'seconds': seconds, 'statements': count_statements(name, filenames, args), 'peak_rss_mb': peak_rss_mb})
+
+def run_in_process(target, *target_args):
+    """
+    Runs a function in a forked process.
+
+    Arguments:
+        target (function): function to run, whose last argument is a connection to send its result to
+        target_args: other arguments of the function
+
+    Returns:
+        result sent by the function
+    """
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=target, args=target_args + (sender,))
+    process.start()
+    result = receiver.recv() if receiver.poll(None) else None
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"{getattr(target, '__name__', target)} failed with exit code {process.exitcode}")
+    return result
+
+def write_corpus(args, connection):
+    """
+    Writes the synthetic contracts and their saved documents, and sends the names of the contract files.
+
+    Arguments:
+        args (argparse.Namespace): arguments of the pipeline, with the number of contracts in 'docs'
+        connection (multiprocessing.connection.Connection): connection to send the file names to
+
+    Returns:
+        None
+    """
+    connection.send(generate_corpus(argparse.Namespace(**dict(vars(args), save_docs=True))))
+
+def benchmark_size(num_docs, bench_args):
+    """
+    Benchmarks the stages on a synthetic corpus of a given number of contracts. The corpus is written in a
+    separate process and is not timed.
+
+    Arguments:
+        num_docs (int): number of contracts
+        bench_args (argparse.Namespace): command-line arguments of the benchmark
+
+    Returns:
+        dictionary with the measurements of each stage that ran
+    """
+    with tempfile.TemporaryDirectory(dir=bench_args.work_directory or None) as directory:
+        args = get_pipeline_args(directory, bench_args)
+        args.docs = num_docs
+        for subdirectory in ["02_parsed_articles", "03_pdata", "04_auth"]:
+            os.makedirs(os.path.join(args.output_directory, subdirectory), exist_ok=True)
+        filenames = run_in_process(write_corpus, args)
+
+        stages = {}
+        for name in bench_args.stages:
+            result = run_in_process(measure_stage, name, filenames, bench_args.model, args)
+            if 'skipped' in result:
+                print(f"{num_docs} docs, {name}: skipped ({result['skipped']})")
+                continue
+            seconds = max(result['seconds'], 1e-9)
+            stages[name] = {'seconds': round(seconds, 3), 'statements': result['statements'],
+                            'docs_per_s': round(num_docs / seconds, 2),
+                            'statements_per_s': round(result['statements'] / seconds, 1),
+                            'peak_rss_mb': round(result['peak_rss_mb'], 1)}
+            print(f"{num_docs} docs, {name}: {seconds:.2f} s, {stages[name]['docs_per_s']:.1f} docs/s, "
+                  f"{stages[name]['statements_per_s']:.0f} statements/s, {stages[name]['peak_rss_mb']:.0f} MB peak RSS")
+    return stages
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Compares the results of a run with a baseline. A stage regressed if its throughput fell, or its peak memory
+    rose, by more than the tolerance.
+
+    Arguments:
+        results (dict): measurements of each stage by number of contracts
+        baseline (dict): baseline measurements in the same format
+        tolerance (float): allowed relative change, e.g. 0.2 for 20%
+
+    Returns:
+        list of str describing the regressions
+    """
+    regressions = []
+    for num_docs, stages in results.items():
+        for name, measured in stages.items():
+            expected = baseline.get(num_docs, {}).get(name)
+            if expected is None:
+                continue
+            if measured['docs_per_s'] < expected['docs_per_s'] * (1 - tolerance):
+                regressions.append(f"{num_docs} docs, {name}: {measured['docs_per_s']:.1f} docs/s, "
+                                   f"baseline {expected['docs_per_s']:.1f} docs/s")
+            if measured['peak_rss_mb'] > expected['peak_rss_mb'] * (1 + tolerance):
+                regressions.append(f"{num_docs} docs, {name}: {measured['peak_rss_mb']:.0f} MB peak RSS, "
+                                   f"baseline {expected['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, nargs='+', default=[1000])
+    parser.add_argument("--sentences", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", type=str, nargs='+', default=stage_names, choices=stage_names)
+    parser.add_argument("--model", type=str, default="pt_core_news_sm")
+    parser.add_argument("--work_directory", type=str, default="")
+    parser.add_argument("--clause", action='store_true')
+    parser.add_argument("--rule_engine", type=str, default="token", choices=["token", "array", "check"])
+    parser.add_argument("--parsed_format", type=str, default="pkl", choices=["pkl", "arrow"])
+    parser.add_argument("--pdata_format", type=str, default="pkl", choices=["pkl", "parquet"])
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--pack_flags", action='store_true')
+    parser.add_argument("--keyed_auth", action='store_true')
+    parser.add_argument("--skip_auth_combine", action='store_true')
+    parser.add_argument("--stream_aggregate", action='store_true')
+    parser.add_argument("--save_baseline", type=str, default="")
+    parser.add_argument("--baseline", type=str, default="")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    bench_args = parser.parse_args()
+
+    # stages run in pipeline order, as each stage reads the outputs of the previous ones
+    bench_args.stages = [name for name in stage_names if name in bench_args.stages]
+    results = {str(num_docs): benchmark_size(num_docs, bench_args) for num_docs in bench_args.docs}
+    settings = {name: getattr(bench_args, name) for name in compared_settings}
+
+    if bench_args.save_baseline:
+        with io.open(bench_args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump({'settings': settings, 'results': results}, f, indent=1)
+
+    if bench_args.baseline:
+        with io.open(bench_args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['settings'] != settings:
+            print(f"Warning: the baseline was run with other settings: {baseline['settings']}")
+        regressions = find_regressions(results, baseline['results'], bench_args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
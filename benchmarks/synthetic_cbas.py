@@ -0,0 +1,304 @@
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import spacy
+from spacy.tokens import Doc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from main02_parse_articles import docs_output_path, new_doc_bin
+from main04_compute_auth import firm, load_lexicon, manager, union, worker
+
+# command to run the file in the terminal (add '--clause' for clause-mode contracts)
+# python benchmarks/synthetic_cbas.py --docs 1000 --input_directory synthetic_cbas --output_directory synthetic_output
+
+# subjects that are not agents, and objects of the verbs
+other_nouns = ['acordo', 'cláusula', 'prazo', 'valor', 'reajuste', 'comissão', 'hora', 'horas', 'jornada', 'convenção']
+objects = ['salário', 'adicional', 'reajuste', 'auxílio', 'benefício', 'desconto', 'abono', 'uniforme', 'seguro',
+           'plano', 'piso', 'horas', 'férias', 'vale', 'relatório', 'comprovante']
+
+# verbs that are not in the verb lexicon
+other_verbs = ['pagar', 'fornecer', 'realizar', 'efetuar', 'comunicar', 'apresentar', 'trabalhar', 'descontar',
+               'compensar', 'dispensar', 'informar']
+
+# names of the clauses of clause-mode contracts
+clause_names = ['Reajuste Salarial', 'Piso Salarial', 'Horas Extras', 'Adicional Noturno', 'Auxílio Alimentação',
+                'Férias', 'Estabilidade Gestante', 'Contribuição Sindical', 'Jornada de Trabalho', 'Uniformes',
+                'Seguro de Vida', 'Plano de Saúde']
+
+# lemma and tag of the words that are not drawn from the vocabulary
+fixed_words = {'não': ('não', 'ADV'), 'que': ('que', 'SCONJ'), 'ser': ('ser', 'AUX'), 'aos': ('a o', 'ADP'),
+               '.': ('.', 'PUNCT')}
+
+# sentence templates, as (word or slot, index of the head, dependency) for each token, with the modal, negation,
+# passive, 'ter que', future, and '-se' patterns handled by the parsing rules
+templates = [
+    # os empregados deverão receber o adicional .
+    [('{det}', 1, 'det'), ('{subject}', 2, 'nsubj'), ('{modal}', 2, 'ROOT'), ('{verb}', 2, 'xcomp'),
+     ('{object_det}', 5, 'det'), ('{object}', 3, 'obj'), ('.', 2, 'punct')],
+    # a empresa pode não descontar o salário .
+    [('{det}', 1, 'det'), ('{subject}', 2, 'nsubj'), ('{modal}', 2, 'ROOT'), ('não', 4, 'advmod'), ('{verb}', 2, 'xcomp'),
+     ('{object_det}', 6, 'det'), ('{object}', 4, 'obj'), ('.', 2, 'punct')],
+    # o sindicato não recebe o relatório .
+    [('{det}', 1, 'det'), ('{subject}', 3, 'nsubj'), ('não', 3, 'advmod'), ('{present}', 3, 'ROOT'),
+     ('{object_det}', 5, 'det'), ('{object}', 3, 'obj'), ('.', 3, 'punct')],
+    # os trabalhadores deverão ser informados .
+    [('{det}', 1, 'det'), ('{subject}', 2, 'nsubj:pass'), ('{modal}', 2, 'ROOT'), ('ser', 4, 'aux:pass'),
+     ('{participle}', 2, 'xcomp'), ('.', 2, 'punct')],
+    # a empresa terá que fornecer o uniforme .
+    [('{det}', 1, 'det'), ('{subject}', 4, 'nsubj'), ('{ter}', 4, 'aux'), ('que', 4, 'mark'), ('{verb}', 4, 'ROOT'),
+     ('{object_det}', 6, 'det'), ('{object}', 4, 'obj'), ('.', 4, 'punct')],
+    # o empregado será dispensado .
+    [('{det}', 1, 'det'), ('{subject}', 3, 'nsubj:pass'), ('{ser}', 3, 'aux:pass'), ('{participle}', 3, 'ROOT'),
+     ('.', 3, 'punct')],
+    # concede-se o abono aos empregados .
+    [('{present}-se', 0, 'ROOT'), ('{object_det}', 2, 'det'), ('{object}', 0, 'nsubj:pass'), ('aos', 4, 'case'),
+     ('{subject}', 0, 'obl'), ('.', 0, 'punct')],
+    # o empregador pagará o piso .
+    [('{det}', 1, 'det'), ('{subject}', 2, 'nsubj'), ('{future}', 2, 'ROOT'), ('{object_det}', 4, 'det'),
+     ('{object}', 2, 'obj'), ('.', 2, 'punct')],
+]
+
+def get_verbs():
+    """
+    Lists the regular verbs of the default verb lexicon together with other common verbs.
+
+    Returns:
+        sorted list of verb lemmas
+    """
+    lexicon_verbs = {verb for voices in load_lexicon("").values() for verbs in voices.values() for verb in verbs}
+    # irregular verbs would be conjugated wrongly
+    return sorted(verb for verb in lexicon_verbs.union(other_verbs)
+                  if verb.endswith(('ar', 'er', 'ir')) and verb not in {'ter', 'ser', 'ver', 'pôr'})
+
+def conjugate(verb, form, plural):
+    """
+    Conjugates a regular verb in the third person.
+
+    Arguments:
+        verb (str): lemma of the verb
+        form (str): 'infinitive', 'present', 'future', or 'participle'
+        plural (bool): whether the subject is plural
+
+    Returns:
+        str
+    """
+    stem, ending = verb[:-2], verb[-2:]
+    if form == 'infinitive':
+        return verb
+    if form == 'present':
+        return stem + ('a' if ending == 'ar' else 'e') + ('m' if plural else '')
+    if form == 'future':
+        return verb + ('ão' if plural else 'á')
+    return stem + ('ado' if ending == 'ar' else 'ido') + ('s' if plural else '')
+
+def get_se_lemmas():
+    """
+    Maps the present tense forms of the verbs, which the parsing rules re-lemmatize after removing a '-se' ending,
+    to their lemmas, so that the rules can run with a pipeline that has no lemmatizer.
+
+    Returns:
+        dictionary mapping each verb form to its lemma
+    """
+    return {conjugate(verb, 'present', plural): verb for verb in get_verbs() for plural in [False, True]}
+
+def get_determiner(noun):
+    """
+    Gives the definite article of a noun.
+
+    Arguments:
+        noun (str): noun
+
+    Returns:
+        str
+    """
+    plural = noun.endswith('s')
+    feminine = noun[:-1].endswith('a') if plural else noun.endswith('a')
+    return ('a' if feminine else 'o') + ('s' if plural else '')
+
+class SentenceGenerator():
+    """
+    Generates annotated sentences from the templates, drawing subjects from the agent dictionaries of stage 04 and
+    verbs from the verb lexicon.
+    """
+    def __init__(self, seed=0, agent_share=0.8):
+        self.random = random.Random(seed)
+        self.agents = sorted(set(worker + firm + union + manager))
+        self.agent_share = agent_share
+        self.verbs = get_verbs()
+
+    def fill_slots(self):
+        """
+        Draws the words of the slots of a sentence.
+
+        Returns:
+            dictionary mapping each slot to its text, lemma, and tag
+        """
+        draw = self.random.choice
+        subject = draw(self.agents) if self.random.random() < self.agent_share else draw(other_nouns)
+        plural = subject.endswith('s')
+        verb, modal, obj = draw(self.verbs), draw(['dever', 'poder']), draw(objects)
+        modal_text = {'dever': ['deve', 'deverá'], 'poder': ['pode', 'poderá']}[modal][self.random.random() < 0.5]
+        if plural:
+            modal_text = modal_text[:-1] + 'ão' if modal_text.endswith('á') else modal_text + 'm'
+        return {
+            'subject': (subject, subject, 'NOUN'),
+            'det': (get_determiner(subject), 'o', 'DET'),
+            'object': (obj, obj, 'NOUN'),
+            'object_det': (get_determiner(obj), 'o', 'DET'),
+            'modal': (modal_text, modal, 'VERB'),
+            'ter': ('terão' if plural else 'terá', 'ter', 'AUX'),
+            'ser': ('serão' if plural else 'será', 'ser', 'AUX'),
+            'verb': (verb, verb, 'VERB'),
+            'present': (conjugate(verb, 'present', plural), verb, 'VERB'),
+            'future': (conjugate(verb, 'future', plural), verb, 'VERB'),
+            'participle': (conjugate(verb, 'participle', plural), verb, 'VERB'),
+        }
+
+    def make_sentence(self):
+        """
+        Generates a sentence from a random template.
+
+        Returns:
+            list of (text, lemma, tag, head, dependency) tuples, with heads indexed within the sentence
+        """
+        slots = self.fill_slots()
+        tokens = []
+        for word, head, dep in self.random.choice(templates):
+            if word.startswith('{'):
+                slot, suffix = word[1:].split('}')
+                text, lemma, tag = slots[slot]
+                text += suffix
+            else:
+                text, (lemma, tag) = word, fixed_words[word]
+            tokens.append((text, lemma, tag, head, dep))
+        return tokens
+
+    def make_text(self, num_sentences):
+        """
+        Generates a text of several sentences.
+
+        Arguments:
+            num_sentences (int): number of sentences
+
+        Returns:
+            list of (text, lemma, tag, head, dependency) tuples, with heads indexed within the text
+        """
+        tokens = []
+        for _ in range(num_sentences):
+            offset = len(tokens)
+            tokens.extend((text, lemma, tag, head + offset, dep) for text, lemma, tag, head, dep in self.make_sentence())
+        return tokens
+
+    def make_contract(self, num_sentences, clause=False):
+        """
+        Generates the texts of a contract, split into clauses in clause mode.
+
+        Arguments:
+            num_sentences (int): average number of sentences of the contract
+            clause (bool): whether to split the contract into clauses
+
+        Returns:
+            list of (tokens, clause_name) tuples, where clause_name is None outside of clause mode
+        """
+        total = max(1, int(self.random.uniform(0.5, 1.5) * num_sentences))
+        if not clause:
+            return [(self.make_text(total), None)]
+        names = self.random.sample(clause_names, min(len(clause_names), max(1, total // 4)))
+        sizes = [total // len(names) + (i < total % len(names)) for i in range(len(names))]
+        return [(self.make_text(max(1, size)), name) for name, size in zip(names, sizes)]
+
+def get_spaces(tokens):
+    """
+    Gives the whitespace after each token: a space, except before a period and at the end of the text.
+
+    Arguments:
+        tokens (list): tokens of a text
+
+    Returns:
+        list of bool
+    """
+    return [i + 1 < len(tokens) and tokens[i + 1][0] != '.' for i in range(len(tokens))]
+
+def tokens_to_text(tokens):
+    """
+    Joins the tokens of a text.
+
+    Arguments:
+        tokens (list): tokens of a text
+
+    Returns:
+        str
+    """
+    return "".join(token[0] + (" " if space else "") for token, space in zip(tokens, get_spaces(tokens)))
+
+def tokens_to_doc(tokens, vocab):
+    """
+    Builds a parsed spaCy document from the annotated tokens of a text, without running a model.
+
+    Arguments:
+        tokens (list): tokens of a text
+        vocab (spacy.vocab.Vocab): vocabulary of the pipeline the document is used with
+
+    Returns:
+        spacy.tokens.Doc
+    """
+    texts, lemmas, tags, heads, deps = zip(*tokens)
+    return Doc(vocab, words=list(texts), spaces=get_spaces(tokens), lemmas=list(lemmas), tags=list(tags),
+               pos=list(tags), heads=list(heads), deps=list(deps))
+
+def generate_corpus(args, vocab=None):
+    """
+    Writes a synthetic corpus of contracts to '--input_directory': plain text files, or JSON lists of
+    [clause_name, clause_text] with '--clause'. With '--save_docs', the parsed documents of each contract are
+    also saved as in stage 02 with '--save_docs', so that the parsing rules can be rerun on them without a model.
+
+    Arguments:
+        args (argparse.Namespace): command-line arguments
+        vocab (spacy.vocab.Vocab): vocabulary to build the documents with, or None for that of a blank
+            Portuguese pipeline
+
+    Returns:
+        list of the names of the contract files
+    """
+    os.makedirs(args.input_directory, exist_ok=True)
+    if args.save_docs:
+        os.makedirs(os.path.join(args.output_directory, "02_docs"), exist_ok=True)
+        vocab = vocab or spacy.blank('pt').vocab
+
+    generator = SentenceGenerator(args.seed)
+    filenames = []
+    for i in range(args.docs):
+        filename = f"synthetic_{i:06d}_cleaned.txt"
+        texts = generator.make_contract(args.sentences, args.clause)
+        with io.open(os.path.join(args.input_directory, filename), 'w', encoding='utf-8') as f:
+            if args.clause:
+                json.dump([[clause_name, tokens_to_text(tokens)] for tokens, clause_name in texts], f, ensure_ascii=False)
+            else:
+                f.write(tokens_to_text(texts[0][0]))
+
+        doc_bin = new_doc_bin(args)
+        if doc_bin is not None:
+            for tokens, clause_name in texts:
+                doc = tokens_to_doc(tokens, vocab)
+                doc.user_data['clause_name'] = clause_name
+                doc_bin.add(doc)
+            doc_bin.to_disk(docs_output_path(filename, args))
+        filenames.append(filename)
+    return filenames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_directory", type=str, required=True)
+    parser.add_argument("--output_directory", type=str, default="")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--sentences", type=int, default=30)
+    parser.add_argument("--clause", action='store_true')
+    parser.add_argument("--save_docs", action='store_true')
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_corpus(args)
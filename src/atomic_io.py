@@ -0,0 +1,37 @@
+import os
+from contextlib import contextmanager
+
+@contextmanager
+def atomic_path(filepath):
+    """
+    Gives a temporary path to write a file to, and renames the temporary file to the file's path once it has
+    been written. A reader then sees either the previous file or the complete new one, never a half-written
+    file, even if the process is killed while writing. The temporary file is hidden (its name starts with a
+    dot) and is removed if writing fails.
+
+    Arguments:
+        filepath (str): path of the file to write
+
+    Returns:
+        context manager giving the temporary path
+    """
+    directory, filename = os.path.split(filepath)
+    temp_fpath = os.path.join(directory, f".{filename}.{os.getpid()}.tmp")
+    try:
+        yield temp_fpath
+        os.replace(temp_fpath, filepath)
+    finally:
+        if os.path.exists(temp_fpath):
+            os.remove(temp_fpath)
+
+def is_temp_file(filename):
+    """
+    Checks whether a file is a temporary file of atomic_path, e.g. one left by a killed process.
+
+    Arguments:
+        filename (str): name of the file
+
+    Returns:
+        bool
+    """
+    return filename.startswith('.') and filename.endswith('.tmp')
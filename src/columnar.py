@@ -0,0 +1,304 @@
+from collections import Counter
+import numpy as np
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pc = None
+    pq = None
+
+# statement fields in the order they are extracted by parse_by_subject
+string_fields = ['subject', 'slem', 'neg', 'modal', 'mlem', 'helping_verb', 'hlem', 'verb', 'vlem']
+int_fields = ['passive', 'md']
+
+# columns of the parsed data in stage 03, and those with few distinct values that are dictionary-encoded
+pdata_fields = ['contract_id', 'subject', 'passive', 'helping_verb', 'verb', 'vlem', 'modal', 'mlem', 'md', 'neg', 'slem']
+categorical_fields = ['vlem', 'mlem', 'slem', 'neg', 'helping_verb']
+
+def require_pyarrow():
+    """
+    Raises an informative error if pyarrow, needed for the columnar formats, is not installed.
+
+    Returns:
+        None
+    """
+    if pa is None:
+        raise ImportError("pyarrow is required for the columnar formats, install it with 'pip install pyarrow'")
+
+def statement_schema(clause):
+    """
+    Builds the Arrow schema of parsed statements, with dictionary-encoded string columns.
+
+    Arguments:
+        clause (bool): whether statements include the clause name
+
+    Returns:
+        pyarrow.Schema
+    """
+    require_pyarrow()
+    string_type = pa.dictionary(pa.int32(), pa.string())
+    fields = [(name, string_type) for name in string_fields] + [(name, pa.int64()) for name in int_fields]
+    if clause:
+        fields.append(('clause_name', string_type))
+    fields.append(('contract_id', string_type))
+    return pa.schema(fields)
+
+def write_statements(statement_list, filepath, clause):
+    """
+    Saves parsed statements as an Arrow IPC file, compressed with zstd when available.
+
+    Arguments:
+        statement_list (list): statements extracted from an article file
+        filepath (str): path of the Arrow file
+        clause (bool): whether statements include the clause name
+
+    Returns:
+        None
+    """
+    schema = statement_schema(clause)
+    table = pa.Table.from_pylist(statement_list, schema=schema)
+    options = pa.ipc.IpcWriteOptions(compression='zstd' if pa.Codec.is_available('zstd') else None)
+    with pa.OSFile(filepath, 'wb') as sink:
+        with pa.ipc.new_file(sink, schema, options=options) as writer:
+            writer.write_table(table)
+
+def read_statements(filepaths):
+    """
+    Loads parsed statements from Arrow IPC files. The files are memory-mapped and their tables are 
+    concatenated without copying.
+
+    Arguments:
+        filepaths (list): paths of the Arrow files
+
+    Returns:
+        pyarrow.Table with the statements of all files, in file order
+    """
+    require_pyarrow()
+    tables = [pa.ipc.open_file(pa.memory_map(filepath, 'r')).read_all() for filepath in filepaths]
+    if not tables:
+        return None
+    return pa.concat_tables(tables)
+
+def decode_strings(table):
+    """
+    Converts the dictionary-encoded columns of a table to plain string columns.
+
+    Arguments:
+        table (pyarrow.Table): table with dictionary-encoded columns
+
+    Returns:
+        pyarrow.Table
+    """
+    columns = [column.cast(pa.string()) if pa.types.is_dictionary(column.type) else column for column in table.columns]
+    return pa.table(columns, names=table.column_names)
+
+def pdata_schema(clause):
+    """
+    Builds the Arrow schema of the parsed data of stage 03, with dictionary-encoded low-cardinality columns.
+
+    Arguments:
+        clause (bool): whether the data includes the clause name
+
+    Returns:
+        pyarrow.Schema
+    """
+    require_pyarrow()
+    fields = []
+    for name in pdata_fields + (['clause_name'] if clause else []):
+        if name in int_fields:
+            fields.append((name, pa.int64()))
+        elif name in categorical_fields:
+            fields.append((name, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append((name, pa.string()))
+    return pa.schema(fields)
+
+def pdata_table(statements, clause):
+    """
+    Converts parsed statements to a table of parsed data with the stage 03 schema.
+
+    Arguments:
+        statements: list of statement dictionaries, or pyarrow.Table of statements
+        clause (bool): whether the data includes the clause name
+
+    Returns:
+        pyarrow.Table
+    """
+    schema = pdata_schema(clause)
+    if isinstance(statements, list):
+        return pa.Table.from_pylist(statements, schema=schema)
+    return statements.select(schema.names).cast(schema)
+
+def concat_pdata(tables, clause):
+    """
+    Concatenates tables of parsed data.
+
+    Arguments:
+        tables (list): tables with the stage 03 schema
+        clause (bool): whether the data includes the clause name
+
+    Returns:
+        pyarrow.Table, empty if there are no tables
+    """
+    return pa.concat_tables(tables) if tables else pdata_schema(clause).empty_table()
+
+def compact_table(table):
+    """
+    Merges the chunks of a table into one and unifies the dictionaries of its dictionary-encoded columns,
+    which makes the table much cheaper to pickle and to count.
+
+    Arguments:
+        table (pyarrow.Table): table to compact
+
+    Returns:
+        pyarrow.Table
+    """
+    return table.unify_dictionaries().combine_chunks()
+
+def count_values(column):
+    """
+    Counts the values of a dictionary-encoded column on its dictionary codes. As with a Counter updated 
+    row by row, values are in order of first appearance.
+
+    Arguments:
+        column (pyarrow.ChunkedArray): dictionary-encoded column of a table compacted with compact_table
+
+    Returns:
+        collections.Counter
+    """
+    array = column.combine_chunks()
+    values = array.dictionary.to_pylist() + [None]
+    codes = pc.fill_null(array.indices, -1).to_numpy(zero_copy_only=False)
+    uniques, first, counts = np.unique(codes, return_index=True, return_counts=True)
+    order = np.argsort(first)
+    return Counter({values[code]: int(count) for code, count in zip(uniques[order], counts[order])})
+
+def iter_row_chunks(tables, chunk_size):
+    """
+    Regroups a stream of tables into consecutive tables of chunk_size rows, followed by a last table with 
+    the remaining rows (which may be empty).
+
+    Arguments:
+        tables: iterable of tables with the same schema
+        chunk_size (int): number of rows per table
+
+    Returns:
+        generator of pyarrow.Table
+    """
+    pending = None
+    for table in tables:
+        pending = table if pending is None else pa.concat_tables([pending, table])
+        while pending.num_rows >= chunk_size:
+            yield pending.slice(0, chunk_size)
+            pending = pending.slice(chunk_size)
+    if pending is not None:
+        yield pending
+
+class PdataWriter():
+    """
+    Streams the parsed data of stage 03 to a single Parquet file, writing a row group each time 
+    row_group_size rows have been added. Used as a context manager, which writes the remaining rows on exit.
+    """
+    def __init__(self, filepath, clause, row_group_size):
+        self.schema = pdata_schema(clause)
+        self.row_group_size = row_group_size
+        self.writer = pq.ParquetWriter(filepath, self.schema, compression='zstd' if pa.Codec.is_available('zstd') else None)
+        self.pending = []
+        self.num_pending = 0
+
+    def write_rows(self, rows):
+        """
+        Adds rows of parsed data.
+
+        Arguments:
+            rows (list): dictionaries with the values of the parsed data columns
+
+        Returns:
+            pyarrow.Table of the added rows
+        """
+        table = pa.Table.from_pylist(rows, schema=self.schema)
+        self.write_table(table)
+        return table
+
+    def write_table(self, table):
+        """
+        Adds a table of parsed data, casting its columns to the parsed data schema.
+
+        Arguments:
+            table (pyarrow.Table): table with the parsed data columns
+
+        Returns:
+            None
+        """
+        self.pending.append(table.select(self.schema.names).cast(self.schema))
+        self.num_pending += table.num_rows
+        if self.num_pending >= self.row_group_size:
+            self.flush(self.row_group_size)
+
+    def flush(self, min_rows=1):
+        """
+        Writes pending rows as full row groups, and the rest as a last row group unless fewer than 
+        min_rows rows remain.
+
+        Arguments:
+            min_rows (int): minimum number of rows of the last row group
+
+        Returns:
+            None
+        """
+        if not self.num_pending:
+            return
+        table = pa.concat_tables(self.pending)
+        num_written = table.num_rows if table.num_rows % self.row_group_size >= min_rows \
+            else table.num_rows - table.num_rows % self.row_group_size
+        if num_written:
+            self.writer.write_table(table.slice(0, num_written), row_group_size=self.row_group_size)
+        self.pending = [table.slice(num_written)] if num_written < table.num_rows else []
+        self.num_pending = table.num_rows - num_written
+
+    def close(self):
+        """
+        Writes the remaining rows and closes the Parquet file.
+
+        Returns:
+            None
+        """
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_pdata_row_group(filepath, row_group, columns=None):
+    """
+    Reads one row group of the stage 03 Parquet file into a DataFrame with plain string columns.
+
+    Arguments:
+        filepath (str): path of the Parquet file
+        row_group (int): index of the row group
+        columns (list): names of the columns to read, or None for all columns
+
+    Returns:
+        pandas.DataFrame
+    """
+    require_pyarrow()
+    table = pq.ParquetFile(filepath).read_row_group(row_group, columns=columns)
+    return decode_strings(table).to_pandas()
+
+def count_row_groups(filepath):
+    """
+    Counts the row groups of a Parquet file.
+
+    Arguments:
+        filepath (str): path of the Parquet file
+
+    Returns:
+        int
+    """
+    require_pyarrow()
+    return pq.ParquetFile(filepath).num_row_groups
@@ -0,0 +1,106 @@
+import io
+import json
+import os
+from collections import OrderedDict
+from atomic_io import atomic_path
+from parse_cache import get_model_version
+
+# pipeline components that do not affect lemmas and are skipped when lemmatizing single words
+unneeded_pipes = {'parser', 'senter', 'ner'}
+
+class LemmaCache():
+    """
+    Bounded least-recently-used cache of the lemmas of single words, used when a verb has to be
+    re-lemmatized outside of its sentence (e.g. after removing a '-se' ending).
+    """
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.lemmas = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lemmatize(self, word, nlp):
+        """
+        Lemmatizes a single word, running the model without the dependency parser on a cache miss.
+
+        Arguments:
+            word (str): word to lemmatize
+            nlp (spacy.Language): Spacy NLP model for text processing
+
+        Returns:
+            str, lowercased lemma of the word
+        """
+        if word in self.lemmas:
+            self.lemmas.move_to_end(word)
+            self.hits += 1
+            return self.lemmas[word]
+
+        self.misses += 1
+        disable = [name for name in nlp.pipe_names if name in unneeded_pipes]
+        lemma = nlp(word, disable=disable)[0].lemma_.lower()
+        self.lemmas[word] = lemma
+        if len(self.lemmas) > self.maxsize:
+            self.lemmas.popitem(last=False)
+        return lemma
+
+    def resize(self, maxsize):
+        """
+        Changes the maximum number of cached lemmas, evicting the least recently used ones if needed.
+
+        Arguments:
+            maxsize (int): maximum number of cached lemmas
+
+        Returns:
+            None
+        """
+        self.maxsize = maxsize
+        while len(self.lemmas) > self.maxsize:
+            self.lemmas.popitem(last=False)
+
+    def load(self, filepath, nlp):
+        """
+        Loads cached lemmas from a JSON file, unless the file is missing or was made with another model.
+
+        Arguments:
+            filepath (str): path to the cache file
+            nlp (spacy.Language): Spacy NLP model for text processing
+
+        Returns:
+            None
+        """
+        if not os.path.exists(filepath):
+            return
+        with io.open(filepath, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data['model'] != get_model_version(nlp):
+            return
+        for word, lemma in data['lemmas']:
+            self.lemmas[word] = lemma
+        self.resize(self.maxsize)
+
+    def save(self, filepath, nlp):
+        """
+        Saves the cached lemmas, from least to most recently used, to a JSON file.
+
+        Arguments:
+            filepath (str): path to the cache file
+            nlp (spacy.Language): Spacy NLP model for text processing
+
+        Returns:
+            None
+        """
+        with atomic_path(filepath) as temp_fpath:
+            with io.open(temp_fpath, 'w', encoding='utf-8') as f:
+                json.dump({'model': get_model_version(nlp), 'lemmas': list(self.lemmas.items())}, f, ensure_ascii=False)
+
+    def stats(self):
+        """
+        Summarizes the cache usage.
+
+        Returns:
+            str, the number of hits, misses, and cached lemmas
+        """
+        return f"Lemma cache: {self.hits} hits, {self.misses} misses, {len(self.lemmas)} cached"
+
+# process-wide lemma cache
+lemma_cache = LemmaCache()
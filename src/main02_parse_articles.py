@@ -6,12 +6,29 @@ from tqdm import tqdm
 import joblib
 import io
 import spacy
+from spacy.attrs import DEP, HEAD, LEMMA, LOWER, ORTH, SENT_START, SPACY, TAG
+from spacy.tokens import DocBin
+import numpy as np
 import re
-from collections import defaultdict
+import hashlib
+import zlib
+from collections import Counter, defaultdict, deque
+from atomic_io import atomic_path
+from columnar import read_statements, write_statements
+from lemma_cache import lemma_cache
+from parse_workers import failures_filename, failure_record, parse_isolated, parse_quarantined, save_failures
+from parse_cache import find_stale_files, get_model_version, load_manifest, record_parsed, remove_deleted_outputs, \
+    remove_journal, save_manifest, start_journal
 
 # command to run the file in the terminal
 # python src/main02_parse_articles.py --input_directory cleaned_cbas --output_directory output
 
+# version of the parsing rules (increment when parse_by_subject changes so cached parses are redone)
+rules_version = 1
+
+# token attributes used by the parsing rules, stored when saving parsed documents
+doc_attrs = ["LEMMA", "TAG", "DEP", "HEAD"]
+
 # subject dependencies
 subdeps = {'nsubj', 'nsubj:pass'}
 
@@ -23,23 +40,84 @@ modal_verbs = {'dever', 'deverá', 'deverão', 'deve', 'devem', 'poder', 'poder
 
 # auxillary verbs to check for
 auxillary_verbs = {'ir', 'haver', 'houverem', 'ter', 'tiverem'}
+
+def get_rules_version():
+    """
+    Fingerprints the parsing rules, combining the rules version with the word sets used by the rules.
+
+    Returns:
+        str, e.g. '1-3f2a9c01b7'
+    """
+    word_sets = json.dumps([sorted(subdeps), sorted(to_be), sorted(modal_verbs), sorted(auxillary_verbs)], ensure_ascii=False)
+    return f"{rules_version}-{hashlib.sha1(word_sets.encode('utf-8')).hexdigest()[:10]}"
  
-def get_statements(article_nlp, nlp):
+# numbers of sentences seen and skipped by the sentence pre-screen
+sentence_counts = Counter()
+
+def screen_sentences(doc):
+    """
+    Finds the sentences that can contain statements, i.e. sentences with a subject dependency and at least
+    three tokens, using the document's DEP and SENT_START arrays rather than its tokens.
+
+    Arguments:
+        doc: spaCy parsed document
+
+    Returns:
+        list of (start, end) token indices of the remaining sentences
+    """
+    if len(doc) == 0:
+        return []
+
+    sent_starts = np.flatnonzero(doc.to_array(SENT_START) == 1)
+    if len(sent_starts) == 0 or sent_starts[0] != 0:
+        sent_starts = np.concatenate([[0], sent_starts])
+    is_subject = np.isin(doc.to_array(DEP), [doc.vocab.strings[d] for d in subdeps])
+    starts, ends = screen_sentence_bounds(sent_starts, is_subject)
+    return list(zip(starts.tolist(), ends.tolist()))
+
+def screen_sentence_bounds(sent_starts, is_subject):
+    """
+    Applies the sentence pre-screen of screen_sentences to the sentences of one or more documents, and
+    counts the sentences seen and skipped.
+
+    Arguments:
+        sent_starts (numpy.ndarray): index of the first token of each sentence, starting with 0
+        is_subject (numpy.ndarray): boolean array of the tokens with a subject dependency
+
+    Returns:
+        tuple of arrays of the start and end token indices of the remaining sentences
+    """
+    sent_ends = np.append(sent_starts[1:], len(is_subject))
+    has_subject = np.add.reduceat(is_subject.astype(np.int64), sent_starts) > 0
+    keep = has_subject & (sent_ends - sent_starts >= 3)
+
+    sentence_counts['sentences'] += len(sent_starts)
+    sentence_counts['skipped'] += int((~keep).sum())
+    return sent_starts[keep], sent_ends[keep]
+
+def get_statements(article_nlp, nlp, engine='token'):
     """
     Extracts statements from the given article's spaCy parsed document.
 
     Arguments:
         article_nlp: spaCy parsed document of the article
         nlp (spacy.Language): Spacy NLP model for text processing
+        engine (str): 'token' to apply the rules to spaCy tokens, 'array' to apply them to the document's
+            attribute arrays, or 'check' to run both and report statements that differ
 
     Returns:
         list of dictionaries, each containing the extracted statement data
         - Each dictionary includes information such as the contract ID, article number,
           sentence number, statement number, and the full sentence text.
     """
+    if engine == 'array':
+        return get_statements_array([article_nlp], nlp)[0]
+
     statement_list = []
+    sentences = screen_sentences(article_nlp)
     
-    for sentence in article_nlp.sents:
+    for start, end in sentences:
+        sentence = article_nlp[start:end]
         tokens = str(sentence).split()
 
         # checks if statement is less than three tokens
@@ -48,56 +126,492 @@ def get_statements(article_nlp, nlp):
         
         sentence_statements = parse_by_subject(sentence, nlp)
         statement_list.extend(sentence_statements)
+
+    if engine == 'check':
+        # the array engine is given the sentences already screened, so that they are counted once
+        array_statement_list = get_statements_array([article_nlp], nlp, [sentences])[0]
+        if array_statement_list != statement_list:
+            print(f"Rule engines differ: {len(statement_list)} token statements, {len(array_statement_list)} array statements")
+            for token_statement, array_statement in zip(statement_list, array_statement_list):
+                if token_statement != array_statement:
+                    print(token_statement)
+                    print(array_statement)
+                    break
             
     return statement_list
 
-def parse_article(filename, nlp, args):
+def get_contract_id(filename):
     """
-    Parses an article file using a given NLP model and saves the extracted statements.
+    Derives the contract ID from the name of a cleaned input file.
+
+    Arguments:
+        filename (str): name of the article file
+
+    Returns:
+        str, the file name without the '_cleaned.txt' suffix
+    """
+    return re.sub(r"_cleaned\.txt$", "", os.path.basename(filename))
+
+def parse_shard(spec):
+    """
+    Parses a '--shard' specification.
+
+    Arguments:
+        spec (str): shard number and number of shards, e.g. '0/4'
+
+    Returns:
+        tuple of the shard number and the number of shards
+    """
+    try:
+        shard, num_shards = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a shard as i/N, got '{spec}'")
+    if not 0 <= shard < num_shards:
+        raise argparse.ArgumentTypeError(f"shard number {shard} is not between 0 and {num_shards - 1}")
+    return shard, num_shards
+
+def select_shard(filenames, shard):
+    """
+    Keeps the article files of one shard of the corpus. Files are assigned to shards by a hash of their 
+    contract ID that does not depend on the machine or the Python process, so every node agrees.
+
+    Arguments:
+        filenames (list): names of the article files
+        shard (tuple): shard number and number of shards, or None for all files
+
+    Returns:
+        list of file names
+    """
+    if shard is None:
+        return filenames
+    shard_num, num_shards = shard
+    return [filename for filename in filenames 
+            if zlib.crc32(get_contract_id(filename).encode('utf-8')) % num_shards == shard_num]
+
+def segment_text(text, max_chars):
+    """
+    Splits a text into segments of at most max_chars characters, preferably at paragraph breaks, then 
+    after the end of a sentence, then at whitespace. Joining the segments gives back the text.
+
+    Arguments:
+        text (str): text to split
+        max_chars (int): maximum number of characters per segment, or 0 to never split
+
+    Returns:
+        list of str, the segments of the text
+    """
+    if not max_chars or len(text) <= max_chars:
+        return [text]
+
+    # splits at the coarsest boundaries that leave no piece longer than the budget
+    pieces = [text]
+    for boundary in [r'(?<=\n\n)', r'(?<=\n)', r'(?<=[.!?;:])(?=\s)', r'(?<=\s)']:
+        pieces = [part for piece in pieces 
+                  for part in (re.split(boundary, piece) if len(piece) > max_chars else [piece]) if part]
+    pieces = [piece[i:i + max_chars] for piece in pieces for i in range(0, len(piece), max_chars)]
+
+    # packs consecutive pieces into segments
+    segments = []
+    segment = ''
+    for piece in pieces:
+        if segment and len(segment) + len(piece) > max_chars:
+            segments.append(segment)
+            segment = ''
+        segment += piece
+    segments.append(segment)
+    return segments
+
+def read_article(filename, args):
+    """
+    Reads the texts to be parsed from an article file, splitting texts longer than '--max_chars' into 
+    segments.
 
     Arguments:
         filename (str): name of the article file
-        nlp (spacy.Language): Spacy NLP model for text processing
         args (argparse.Namespace): command-line arguments
 
     Returns:
-        None
+        list of (text, clause_name) tuples, where clause_name is None outside of clause mode
     """
-    statement_list = []
     filepath = os.path.join(args.input_directory, filename)
-    contract_id = re.sub(r"_cleaned\.txt$", "", os.path.basename(filename))
+    with open(filepath, 'r', encoding='utf-8') as f:
+        if args.clause:
+            texts = [(clause[1], clause[0]) for clause in json.load(f)]
+        else:
+            texts = [(f.read(), None)]
+    return [(segment, clause_name) for text, clause_name in texts for segment in segment_text(text, args.max_chars)]
 
-    if args.clause:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            for clause in data:
-                try:
-                    clause_nlp = nlp(clause[1])
-                except Exception as e:
-                    print(f"Error occurred: {str(e)}")
-                    print(filename)
-                clause_statements = get_statements(clause_nlp, nlp)
-                for statement in clause_statements:
-                    statement['clause_name'] = clause[0]
-                statement_list.extend(clause_statements)  
+def parsed_output_path(filename, args):
+    """
+    Gives the path of the parsed output file for an article file.
+
+    Arguments:
+        filename (str): name of the article file
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        str, path of the file in the '02_parsed_articles' directory
+    """
+    extension = "arrow" if args.parsed_format == "arrow" else "pkl"
+    return os.path.join(args.output_directory, "02_parsed_articles", filename[:-3] + extension)
+
+def docs_output_path(filename, args):
+    """
+    Gives the path of the saved spaCy documents for an article file.
+
+    Arguments:
+        filename (str): name of the article file
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        str, path of the file in the '02_docs' directory
+    """
+    return os.path.join(args.output_directory, "02_docs", filename[:-3] + "spacy")
+
+def get_doc_statements(doc, clause_name, nlp, args, doc_bin=None):
+    """
+    Extracts the statements of a parsed document (or clause), optionally adding the document to a DocBin.
+
+    Arguments:
+        doc: spaCy parsed document of the article or clause
+        clause_name (str): name of the clause, or None outside of clause mode
+        nlp (spacy.Language): Spacy NLP model for text processing
+        args (argparse.Namespace): command-line arguments
+        doc_bin (spacy.tokens.DocBin): collection of documents to save, or None
+
+    Returns:
+        list of dictionaries, each containing the extracted statement data
+    """
+    return get_docs_statements([doc], [clause_name], nlp, args, doc_bin)
+
+def get_docs_statements(docs, clause_names, nlp, args, doc_bin=None):
+    """
+    Extracts the statements of the parsed documents (or clauses) of an article, optionally adding the 
+    documents to a DocBin. With '--rule_engine array', the rules are applied to all the documents at once.
+
+    Arguments:
+        docs (list): spaCy parsed documents of the article or of its clauses
+        clause_names (list): name of the clause of each document, or None outside of clause mode
+        nlp (spacy.Language): Spacy NLP model for text processing
+        args (argparse.Namespace): command-line arguments
+        doc_bin (spacy.tokens.DocBin): collection of documents to save, or None
+
+    Returns:
+        list of dictionaries, each containing the extracted statement data
+    """
+    if doc_bin is not None:
+        for doc, clause_name in zip(docs, clause_names):
+            doc.user_data['clause_name'] = clause_name
+            doc_bin.add(doc)
+    if args.rule_engine == 'array':
+        docs_statements = get_statements_array(docs, nlp)
     else:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            try:
-                art_nlp = nlp(f.read())
-            except Exception as e:
-                print(f"Error occurred: {str(e)}")
-                print(filename)
-        article_statements = get_statements(art_nlp, nlp)
-        statement_list.extend(article_statements)        
+        docs_statements = [get_statements(doc, nlp, args.rule_engine) for doc in docs]
+
+    statement_list = []
+    for doc_statements, clause_name in zip(docs_statements, clause_names):
+        if clause_name is not None:
+            for statement in doc_statements:
+                statement['clause_name'] = clause_name
+        statement_list.extend(doc_statements)
+    return statement_list
+
+def new_doc_bin(args):
+    """
+    Creates a DocBin for the parsed documents of an article file if the '--save_docs' flag is given.
+
+    Arguments:
+        args (argparse.Namespace): command-line arguments
 
+    Returns:
+        spacy.tokens.DocBin storing the attributes used by the parsing rules, or None
+    """
+    return DocBin(attrs=doc_attrs, store_user_data=True) if args.save_docs else None
+
+def save_statements(filename, statement_list, args, doc_bin=None):
+    """
+    Attaches the contract ID to each statement and saves the statements of an article file. Files are written 
+    atomically, and the article file is then added to the journal of the run.
+
+    Arguments:
+        filename (str): name of the article file
+        statement_list (list): statements extracted from the article file
+        args (argparse.Namespace): command-line arguments
+        doc_bin (spacy.tokens.DocBin): parsed documents of the article file to save, or None
+
+    Returns:
+        None
+    """
+    if doc_bin is not None:
+        with atomic_path(docs_output_path(filename, args)) as temp_fpath:
+            doc_bin.to_disk(temp_fpath)
+
+    contract_id = get_contract_id(filename)
     for statement in statement_list:
         statement['contract_id'] = contract_id    
 
-    parses_fpath = os.path.join(args.output_directory, "02_parsed_articles", filename[:-3] + "pkl") 
-    joblib.dump(statement_list, parses_fpath)
+    with atomic_path(parsed_output_path(filename, args)) as parses_fpath:
+        if args.parsed_format == "arrow":
+            write_statements(statement_list, parses_fpath, args.clause)
+        else:
+            joblib.dump(statement_list, parses_fpath)
+    record_parsed(filename, args)
     # with io.open(parses_fpath, 'w', encoding='utf-8') as f:
     #     json.dump(statement_list, f)
 
+def is_loadable(filepath, args):
+    """
+    Checks that a parsed output file exists and loads cleanly, e.g. before trusting the output of an 
+    interrupted run.
+
+    Arguments:
+        filepath (str): path of the parsed output file
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        bool
+    """
+    try:
+        if args.parsed_format == "arrow":
+            read_statements([filepath])
+        else:
+            joblib.load(filepath)
+    except Exception:
+        return False
+    return True
+
+def parse_article(filename, nlp, args):
+    """
+    Parses an article file using a given NLP model and saves the extracted statements. Errors are raised
+    to the caller, and nothing is saved for a file that cannot be parsed.
+
+    Arguments:
+        filename (str): name of the article file
+        nlp (spacy.Language): Spacy NLP model for text processing
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        None
+    """
+    doc_bin = new_doc_bin(args)
+    texts = read_article(filename, args)
+    docs = [nlp(text) for text, clause_name in texts]
+    statement_list = get_docs_statements(docs, [clause_name for text, clause_name in texts], nlp, args, doc_bin)
+
+    save_statements(filename, statement_list, args, doc_bin)
+
+def reparse_article(filename, nlp, args):
+    """
+    Re-runs the parsing rules on the saved spaCy documents of an article file and saves the extracted 
+    statements, without running the NLP model.
+
+    Arguments:
+        filename (str): name of the article file
+        nlp (spacy.Language): Spacy NLP model whose vocabulary the documents are loaded with
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        None
+    """
+    doc_bin = DocBin().from_disk(docs_output_path(filename, args))
+    docs = list(doc_bin.get_docs(nlp.vocab))
+    statement_list = get_docs_statements(docs, [doc.user_data.get('clause_name') for doc in docs], nlp, args)
+    save_statements(filename, statement_list, args)
+
+def parse_articles_pipe(filenames, nlp, args):
+    """
+    Parses article files by streaming their texts through nlp.pipe in batches, optionally across 
+    several processes, and saves the extracted statements of each file.
+
+    Texts are passed with their file name and clause name as context. Since nlp.pipe yields documents 
+    in input order, a file is complete (and saved) as soon as a document of a later file comes back. A 
+    file whose statements cannot be extracted is not saved and is recorded as failed. If the model itself
+    raises an error, the files of the failed batch are parsed one at a time (see parse_quarantined), so 
+    that only the file that fails is recorded, and the remaining files are streamed through nlp.pipe again.
+
+    Arguments:
+        filenames (list): names of the article files
+        nlp (spacy.Language): Spacy NLP model for text processing
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        dictionary of failure records by file name
+    """
+    remaining = deque(filenames)
+    pending = deque()
+    statements = defaultdict(list)
+    doc_bins = {}
+    # sentences screened for each unfinished file, which are counted again if the file is parsed again
+    screened = defaultdict(Counter)
+    failures = {}
+    progress = tqdm(total=len(filenames))
+
+    def texts():
+        while remaining:
+            filename = remaining.popleft()
+            pending.append(filename)
+            doc_bins[filename] = new_doc_bin(args)
+            for text, clause_name in read_article(filename, args):
+                yield text, (filename, clause_name)
+
+    def flush_until(filename):
+        while pending and pending[0] != filename:
+            finished = pending[0]
+            if finished not in failures:
+                save_statements(finished, statements.pop(finished, []), args, doc_bins.pop(finished))
+            screened.pop(finished, None)
+            pending.popleft()
+            progress.update()
+
+    while remaining:
+        docs = nlp.pipe(texts(), as_tuples=True, batch_size=args.batch_size, n_process=args.n_process)
+        try:
+            for doc, (filename, clause_name) in docs:
+                flush_until(filename)
+                if filename in failures:
+                    continue
+                counts_before = Counter(sentence_counts)
+                try:
+                    statements[filename].extend(get_doc_statements(doc, clause_name, nlp, args, doc_bins[filename]))
+                    screened[filename].update(sentence_counts - counts_before)
+                except Exception as e:
+                    failures[filename] = failure_record(filename, f"{type(e).__name__}: {e}", 1)
+            flush_until(None)
+        except Exception:
+            # the model failed on a batch, which stops nlp.pipe: the unfinished files are parsed one at a time
+            while pending:
+                filename = pending.popleft()
+                statements.pop(filename, None)
+                doc_bins.pop(filename, None)
+                sentence_counts.subtract(screened.pop(filename, Counter()))
+                if filename not in failures:
+                    parse_quarantined(parse_article, filename, nlp, args, failures)
+                progress.update()
+    progress.close()
+    return failures
+
+def parse_articles(filenames, nlp, args):
+    """
+    Parses article files one at a time, or through nlp.pipe when the '--pipe' flag is given. Files whose
+    contents, spaCy model, and parsing rules are unchanged since the last run are skipped (unless the 
+    '--force' flag is given), and parsed files of deleted inputs are removed. With '--shard i/N', only the
+    files of shard i of N are parsed (see select_shard), only the outputs of the shard's contracts are removed
+    as stale, and a run refuses to parse into an output directory that holds the parsed files of another shard
+    (or of all files) unless the '--force' flag is given.
+
+    With the '--save_docs' flag, the parsed spaCy documents are also saved to '02_docs', and unchanged files
+    whose documents were not saved (e.g. parsed by a run without the flag) are parsed again. With the 
+    '--reuse_parses' flag, files whose saved documents match their current contents are not parsed again;
+    only the parsing rules are re-run on the saved documents.
+
+    Files that cannot be parsed are quarantined: they are listed in '02_failures.jsonl', their outputs 
+    are removed, and they are parsed again on the next run. With the '--isolate' flag, files are parsed
+    in supervised worker processes with time and memory limits (see parse_workers.parse_isolated).
+
+    Each parsed file is recorded in the journal '02_journal.jsonl' as soon as its outputs are saved, and the
+    journal is removed once the manifest is saved. With the '--resume' flag, the files journaled by an 
+    interrupted run with the same settings are not parsed again if their contents are unchanged and their
+    outputs load cleanly.
+
+    Arguments:
+        filenames (list): names of the article files
+        nlp (spacy.Language): Spacy NLP model for text processing
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        None
+    """
+    filenames = select_shard(filenames, args.shard)
+    manifest = load_manifest(args)
+    shard = list(args.shard) if args.shard is not None else None
+    if manifest['files'] and manifest.get('shard') != shard and not args.force:
+        raise ValueError(f"{args.output_directory} has the parsed files of another shard "
+                         f"({manifest.get('shard') or 'all files'}); use a separate output directory for each shard, "
+                         f"or '--force' to parse into this one")
+    settings = {'model': get_model_version(nlp), 'rules': get_rules_version(), 'clause': args.clause, 
+                'max_chars': args.max_chars}
+    output_path = lambda filename: parsed_output_path(filename, args)
+    stale, hashes = find_stale_files(filenames, {'files': {}} if args.force else manifest, settings, output_path, args)
+    # outputs of the contracts of other shards are left alone
+    is_owned = None
+    if args.shard is not None:
+        is_owned = lambda output_fname: bool(select_shard([os.path.splitext(output_fname)[0] + ".txt"], args.shard))
+    removed = remove_deleted_outputs(filenames, os.path.join(args.output_directory, "02_parsed_articles"), output_path,
+                                     is_owned)
+
+    # saved documents are valid while the model, the clause mode, and the file contents are unchanged
+    docs_settings = {'model': settings['model'], 'clause': args.clause}
+    saved_docs = {}
+    if manifest.get('docs_settings') == docs_settings:
+        saved_docs = {filename: file_hash for filename, file_hash in manifest.get('docs', {}).items() 
+                      if hashes.get(filename) == file_hash}
+    docs_directory = os.path.join(args.output_directory, "02_docs")
+    if args.save_docs:
+        os.makedirs(docs_directory, exist_ok=True)
+    if os.path.isdir(docs_directory):
+        remove_deleted_outputs(list(saved_docs), docs_directory, lambda filename: docs_output_path(filename, args), is_owned)
+    if args.save_docs:
+        # unchanged files whose documents were not saved are parsed again, so that every file has its documents
+        has_docs = lambda filename: filename in saved_docs and os.path.exists(docs_output_path(filename, args))
+        stale_files = set(stale)
+        stale = [filename for filename in filenames if filename in stale_files or not has_docs(filename)]
+
+    # with '--resume', files parsed by an interrupted run are kept if their outputs load cleanly
+    journaled = start_journal(settings, args)
+    resumed = [filename for filename in stale if journaled.get(filename) == hashes[filename]
+               and is_loadable(output_path(filename), args)
+               and (not args.save_docs or os.path.exists(docs_output_path(filename, args)))]
+    stale = [filename for filename in stale if filename not in set(resumed)]
+
+    reused = []
+    if args.reuse_parses:
+        reused = [filename for filename in stale if filename in saved_docs]
+        stale = [filename for filename in stale if filename not in saved_docs]
+
+    lemma_cache.resize(args.lemma_cache_size)
+    if args.lemma_cache:
+        lemma_cache.load(args.lemma_cache, nlp)
+
+    failures = {}
+    for filename in tqdm(reused):
+        parse_quarantined(reparse_article, filename, nlp, args, failures)
+
+    if args.isolate:
+        failures.update(parse_isolated(stale, parse_article, nlp, args, sentence_counts))
+    elif args.pipe:
+        failures.update(parse_articles_pipe(stale, nlp, args))
+    else:
+        for filename in tqdm(stale):
+            parse_quarantined(parse_article, filename, nlp, args, failures)
+
+    # failed files keep no outputs and are left out of the manifest, so the next run parses them again
+    for filename in failures:
+        for fpath in [parsed_output_path(filename, args), docs_output_path(filename, args)]:
+            if os.path.exists(fpath):
+                os.remove(fpath)
+        hashes.pop(filename)
+        saved_docs.pop(filename, None)
+    save_failures(failures, args)
+
+    if args.lemma_cache:
+        lemma_cache.save(args.lemma_cache, nlp)
+
+    if args.save_docs:
+        saved_docs.update((filename, hashes[filename]) for filename in stale + resumed if filename not in failures
+                          and os.path.exists(docs_output_path(filename, args)))
+    manifest = dict(settings, files=hashes, docs_settings=docs_settings, docs=saved_docs, shard=shard)
+    save_manifest(manifest, args)
+    remove_journal(args)
+    # quarantined files are counted apart from the files that were parsed or re-run
+    succeeded = lambda names: len([filename for filename in names if filename not in failures])
+    print(f"Parse cache: {len(filenames) - len(stale) - len(reused) - len(resumed)} unchanged, {succeeded(reused)} re-run "
+          f"from saved docs, {len(resumed)} resumed, {succeeded(stale)} parsed, {len(failures)} quarantined, "
+          f"{removed} stale removed")
+    if failures:
+        print(f"Quarantined {len(failures)} files that could not be parsed, see {failures_filename}")
+    print(lemma_cache.stats())
+    print(f"Sentence pre-screen: {sentence_counts['skipped']} of {sentence_counts['sentences']} sentences skipped")
+
 def parse_by_subject(sent, nlp):
     """
     Parses a sentence based on its subject and extracts relevant information related to clauses, 
@@ -187,36 +701,6 @@ def parse_by_subject(sent, nlp):
                 if child.dep_ == 'aux' and child.lemma_.lower() in auxillary_verbs:
                     helping_verb_text, hlem = child.text, child.lemma_.lower()
 
-        # checks for -se-á and -se-ão at the end of a verb
-        if not hlem and not mlem:
-            if verb_text.endswith('-se-á') or verb_text.endswith('-se-ão'):
-                mlem, hlem = 'ir', 'se'
-                if verb_text.endswith('-se-á'):
-                    vlem = verb_text.replace('-se-á', '').lower()
-                else:
-                    vlem = verb_text.replace('-se-ão', '').lower()
-                # checks for irregular future tense verbs
-                vlem = 'fazer' if vlem == 'far' else ('trazer' if vlem == 'trar' else ('dizer' if vlem == 'dir' else vlem))
-
-        # checks for future tense verbs
-        if not mlem:
-            if verb_text.endswith('rá') or helping_verb_text.endswith('rá') or verb_text.endswith('-á') or  \
-                    helping_verb_text.endswith('-á') or verb_text.endswith('rão') or helping_verb_text.endswith('rão') or \
-                    verb_text.endswith('-ão') or helping_verb_text.endswith('-ão'):
-                mlem = 'ir'
-
-        # checks for -se at the end of or in the middle of a verb phrase
-        if not hlem and '-se' in verb_text:
-            hlem = 'se'
-            verb_stem = verb_text.split('-')[0]
-            try:
-                # re-lemmatizes the verb without the '-se' ending
-                vlem = nlp(verb_stem)[0].lemma_.lower()
-            except Exception as e:
-                print(f"Error occurred: {str(e)}")
-                print(sent)
-                continue
-                           
         # checks if the verb is negated 
         neg = ''
         neg = 'não' if any(t.text.lower() == 'não' for t in verb.children) else neg
@@ -234,27 +718,345 @@ def parse_by_subject(sent, nlp):
                 'vlem': vlem,
                 'passive': 0,
                 'md': 0}
-        
-        # checks if the sentence is passive
-        # (ter + garantido is a common case counted as passive since it translates to 'to be guaranteed')
-        if (subject.dep_ == 'nsubj:pass') or (hlem == 'se') or (hlem in to_be and not verb_text.endswith('ndo')) or \
-                (hlem == 'ter' and vlem == 'garantir'):
-            data['passive'] = 1
-        
-        # checks if the sentence contains a modal verb
-        if mlem != "":
-            data['md'] = 1
+        if complete_statement(data, subject.dep_ == 'nsubj:pass', nlp) is None:
+            print(sent)
+            continue
 
         datalist.append(data)
     
     return datalist
 
 
+def complete_statement(data, passive_subject, nlp):
+    """
+    Applies the parsing rules shared by both rule engines to a statement whose subject, verb, modal verb,
+    and helping verb were found: the rules on the verb texts (future tense and '-se' forms) and the
+    passive and modal flags.
+
+    Arguments:
+        data (dict): statement data, updated in place
+        passive_subject (bool): whether the subject is a passive subject
+        nlp: spaCy natural language processer
+
+    Returns:
+        dict, the statement data, or None if the verb cannot be re-lemmatized
+    """
+    verb_text, helping_verb_text = data['verb'], data['helping_verb']
+
+    # checks for -se-á and -se-ão at the end of a verb
+    if not data['hlem'] and not data['mlem']:
+        if verb_text.endswith('-se-á') or verb_text.endswith('-se-ão'):
+            data['mlem'], data['hlem'] = 'ir', 'se'
+            if verb_text.endswith('-se-á'):
+                vlem = verb_text.replace('-se-á', '').lower()
+            else:
+                vlem = verb_text.replace('-se-ão', '').lower()
+            # checks for irregular future tense verbs
+            data['vlem'] = 'fazer' if vlem == 'far' else ('trazer' if vlem == 'trar' else ('dizer' if vlem == 'dir' else vlem))
+
+    # checks for future tense verbs
+    if not data['mlem']:
+        if verb_text.endswith('rá') or helping_verb_text.endswith('rá') or verb_text.endswith('-á') or  \
+                helping_verb_text.endswith('-á') or verb_text.endswith('rão') or helping_verb_text.endswith('rão') or \
+                verb_text.endswith('-ão') or helping_verb_text.endswith('-ão'):
+            data['mlem'] = 'ir'
+
+    # checks for -se at the end of or in the middle of a verb phrase
+    if not data['hlem'] and '-se' in verb_text:
+        data['hlem'] = 'se'
+        verb_stem = verb_text.split('-')[0]
+        try:
+            # re-lemmatizes the verb without the '-se' ending
+            data['vlem'] = lemma_cache.lemmatize(verb_stem, nlp)
+        except Exception as e:
+            print(f"Error occurred: {str(e)}")
+            return None
+
+    # checks if the sentence is passive
+    # (ter + garantido is a common case counted as passive since it translates to 'to be guaranteed')
+    hlem, vlem = data['hlem'], data['vlem']
+    if passive_subject or (hlem == 'se') or (hlem in to_be and not verb_text.endswith('ndo')) or \
+            (hlem == 'ter' and vlem == 'garantir'):
+        data['passive'] = 1
+
+    # checks if the sentence contains a modal verb
+    if data['mlem'] != "":
+        data['md'] = 1
+
+    return data
+
+def get_token_arrays(docs):
+    """
+    Extracts the token attributes used by the parsing rules from spaCy parsed documents as arrays, with
+    the tokens of all the documents one after the other, and evaluates the token-level conditions of the
+    rules (e.g. whether a token's lemma is a modal verb, or whether it has a 'não' child) for all of them.
+
+    Arguments:
+        docs (list): spaCy parsed documents sharing a vocabulary
+
+    Returns:
+        dictionary of token attribute and condition arrays, and of the texts of the token and lemma IDs
+    """
+    strings = docs[0].vocab.strings
+    columns = np.concatenate([doc.to_array([DEP, LEMMA, TAG, ORTH, SPACY, SENT_START, HEAD]) for doc in docs])
+    dep, tag = columns[:, 0], columns[:, 2]
+    positions = np.arange(len(columns))
+    # heads are relative to their tokens, so they stay within their own documents
+    head = columns[:, 6].astype(np.int64) + positions
+    is_child = head != positions
+
+    # texts of the distinct tokens and lowercased lemmas, whose conditions are checked once for each
+    orths, orth_index = np.unique(columns[:, 3], return_inverse=True)
+    lemmas, lemma_index = np.unique(columns[:, 1], return_inverse=True)
+    deps, dep_index = np.unique(dep, return_inverse=True)
+    orth_text = [strings[i] for i in orths.tolist()]
+    lemma_lower = [strings[i].lower() for i in lemmas.tolist()]
+    dep_labels = [strings[i] for i in deps.tolist()]
+    lemma_in = lambda words: np.array([text in words for text in lemma_lower], dtype=bool)[lemma_index]
+    dep_in = lambda labels: np.array([label in labels for label in dep_labels], dtype=bool)[dep_index]
+    is_nao = np.array([text.lower() == 'não' for text in orth_text], dtype=bool)[orth_index]
+
+    is_modal = lemma_in(modal_verbs)
+    is_to_be = lemma_in(to_be)
+    is_xcomp = dep == strings['xcomp']
+    is_cop = dep == strings['cop']
+    is_aux_dep = np.array([label.startswith('aux') for label in dep_labels], dtype=bool)[dep_index]
+    has_sconj_child = get_child_flags(head, is_child & (tag == strings['SCONJ']))
+
+    # the first child of each verb matching one of the rules that look for a modal or helping verb, which
+    # are tried in order: 1 a modal verb with a complement, 2 a form of 'to be' with a verb complement, 3 an
+    # auxiliary form of 'to be', 4 the pronoun 'se', and 5 a copulative verb; a child with a subordinating
+    # conjunction of its own fails rules 2 and 3 without trying the next ones (the conditions of the
+    # rules exclude each other, so each child gets the number of the rule it matches, or 0)
+    parent_modal, parent_to_be = is_modal[head], is_to_be[head]
+    rule_1 = is_xcomp & parent_modal
+    tries_rule_2 = is_xcomp & (tag == strings['VERB']) & parent_to_be & ~rule_1
+    tries_rule_3 = is_aux_dep & is_to_be & ~rule_1 & ~tries_rule_2
+    tries_next = ~rule_1 & ~tries_rule_2 & ~tries_rule_3
+    rules = (rule_1 * 1 + (tries_rule_2 & ~has_sconj_child) * 2 + (tries_rule_3 & ~has_sconj_child) * 3 +
+             (tries_next & (dep == strings['expl']) & lemma_in({'se'})) * 4 + (tries_next & is_cop) * 5) * is_child
+
+    # first token of each document, which also starts a sentence
+    doc_starts = np.cumsum([0] + [len(doc) for doc in docs])
+    is_sent_start = columns[:, 5] == 1
+    is_sent_start[doc_starts[:-1][np.diff(doc_starts) > 0]] = True
+
+    return {'head': head, 'orth_index': orth_index, 'lemma_index': lemma_index, 'space': columns[:, 4],
+            'orth_text': orth_text, 'lemma_lower': lemma_lower, 'doc_starts': doc_starts,
+            'sent_starts': np.flatnonzero(is_sent_start), 'is_subject': dep_in(subdeps),
+            'is_que': lemma_in({'que'}), 'is_passive_subject': dep == strings['nsubj:pass'],
+            'rule': rules, 'first_rule_child': get_child_index(head, rules > 0),
+            'last_helping_child': get_child_index(head, is_child & (is_aux_dep | is_cop), last=True),
+            'last_auxillary_child': get_child_index(head, is_child & (dep == strings['aux']) & lemma_in(auxillary_verbs),
+                                                    last=True),
+            'first_ter_child': get_child_index(head, is_child & lemma_in({'ter'})),
+            'has_que_child': get_child_flags(head, is_child & lemma_in({'que'})),
+            'has_nao_child': get_child_flags(head, is_child & is_nao)}
+
+def get_child_index(head, mask, last=False):
+    """
+    Finds the first (or last) child of each token among the tokens of a mask.
+
+    Arguments:
+        head (numpy.ndarray): index of the head of each token
+        mask (numpy.ndarray): boolean array of the children to consider
+        last (bool): whether to find the last child instead of the first
+
+    Returns:
+        numpy.ndarray with the index of the child of each token, -1 for tokens without one
+    """
+    children = np.flatnonzero(mask)
+    if not last:
+        children = children[::-1]
+    # with repeated heads, the child assigned last is kept
+    index = np.full(len(head), -1, dtype=np.int64)
+    index[head[children]] = children
+    return index
+
+def get_child_flags(head, mask):
+    """
+    Checks which tokens have a child among the tokens of a mask.
+
+    Arguments:
+        head (numpy.ndarray): index of the head of each token
+        mask (numpy.ndarray): boolean array of the children to consider
+
+    Returns:
+        boolean numpy.ndarray
+    """
+    return np.bincount(head[mask], minlength=len(head)) > 0
+
+def count_words(arrays, starts, ends):
+    """
+    Counts the words of sentences as str(sentence).split() does, from the texts and trailing whitespace
+    of their tokens.
+
+    Arguments:
+        arrays (dict): token attributes, as returned by get_token_arrays
+        starts (numpy.ndarray): index of the first token of each sentence
+        ends (numpy.ndarray): index after the last token of each sentence
+
+    Returns:
+        numpy.ndarray with the number of words of each sentence
+    """
+    orth_text, orth_index = arrays['orth_text'], arrays['orth_index']
+    # words of each token, whether its text starts and ends within a word
+    words = np.array([len(text.split()) for text in orth_text], dtype=np.int64)[orth_index]
+    starts_in_word = np.array([not text[:1].isspace() for text in orth_text], dtype=bool)[orth_index]
+    ends_in_word = np.array([not text[-1:].isspace() for text in orth_text], dtype=bool)[orth_index]
+
+    # a token's first word continues the last word of the previous token if no whitespace separates them
+    continues = np.zeros(len(words), dtype=bool)
+    continues[1:] = starts_in_word[1:] & ends_in_word[:-1] & (arrays['space'][:-1] == 0) & (words[:-1] > 0) & \
+        (words[1:] > 0)
+    continues[starts] = False
+    cumulative = np.concatenate([[0], np.cumsum(words - continues)])
+    return cumulative[ends] - cumulative[starts]
+
+def get_statements_array(docs, nlp, sentences=None):
+    """
+    Extracts statements from spaCy parsed documents, applying the parsing rules to the attribute arrays of
+    all the documents at once. Produces the same statements as get_statements.
+
+    Arguments:
+        docs (list): spaCy parsed documents, e.g. the clauses of an article
+        nlp (spacy.Language): Spacy NLP model for text processing
+        sentences (list): (start, end) token indices of the sentences of each document kept by
+            screen_sentences, or None to screen the sentences of the documents
+
+    Returns:
+        list with the list of statement dictionaries of each document
+    """
+    docs = list(docs)
+    if sum(len(doc) for doc in docs) == 0:
+        return [[] for doc in docs]
+    arrays = get_token_arrays(docs)
+    doc_starts = arrays['doc_starts']
+
+    if sentences is None:
+        starts, ends = screen_sentence_bounds(arrays['sent_starts'], arrays['is_subject'])
+    else:
+        bounds = [(doc_start + start, doc_start + end) for doc_start, doc_sentences in zip(doc_starts.tolist(), sentences)
+                  for start, end in doc_sentences]
+        starts, ends = np.array(bounds, dtype=np.int64).reshape(-1, 2).T
+
+    # checks if statement is less than three tokens
+    kept = count_words(arrays, starts, ends) >= 3
+    starts, ends = starts[kept], ends[kept]
+
+    # subjects of the kept sentences, in token order, with their sentences and documents
+    in_sentence = np.zeros(doc_starts[-1] + 1, dtype=np.int64)
+    np.add.at(in_sentence, starts, 1)
+    np.add.at(in_sentence, ends, -1)
+    subjects = np.flatnonzero(arrays['is_subject'] & (np.cumsum(in_sentence)[:-1] > 0))
+    sentence_of = np.searchsorted(starts, subjects, side='right') - 1
+    doc_of = np.searchsorted(doc_starts, subjects, side='right') - 1
+
+    def get_sentence(i):
+        doc_start = doc_starts[doc_of[i]]
+        return docs[doc_of[i]][starts[sentence_of[i]] - doc_start:ends[sentence_of[i]] - doc_start]
+
+    statements = [[] for doc in docs]
+    for i, data in parse_by_subject_array(arrays, subjects, nlp, get_sentence):
+        statements[doc_of[i]].append(data)
+    return statements
+
+def parse_by_subject_array(arrays, subjects, nlp, get_sentence):
+    """
+    Array-based version of parse_by_subject, applying the same rules to subjects given by their token
+    indices. The verbs, modal verbs, and helping verbs of all the subjects are found at once.
+
+    Arguments:
+        arrays (dict): token attributes, as returned by get_token_arrays
+        subjects (numpy.ndarray): indices of the subject tokens, in token order
+        nlp: spaCy natural language processer
+        get_sentence (function): gives the sentence of the i-th subject, used for error messages
+
+    Returns:
+        list of (i, statement dictionary) tuples, where i is the position of the statement's subject
+    """
+    head, rule, first_rule_child = arrays['head'], arrays['rule'], arrays['first_rule_child']
+
+    # checks for modal and passive verbs
+    verbs = head[subjects]
+    child = first_rule_child[verbs]
+    subject_rule = np.where(child >= 0, rule[child], 0)
+    modals = np.where(subject_rule == 1, verbs, -1)
+    helping_verbs = np.where(subject_rule == 1, arrays['last_helping_child'][child],
+                             np.where(subject_rule == 2, verbs, np.where((subject_rule == 3) | (subject_rule == 4), child, -1)))
+    verbs = np.where((subject_rule == 1) | (subject_rule == 2) | (subject_rule == 5), child, verbs)
+
+    # checks if the verb is negated
+    has_nao_child = arrays['has_nao_child']
+    negated = has_nao_child[verbs] | ((helping_verbs >= 0) & has_nao_child[helping_verbs])
+
+    orth_text, lemma_lower = arrays['orth_text'], arrays['lemma_lower']
+    orth_index, lemma_index = arrays['orth_index'].tolist(), arrays['lemma_index'].tolist()
+    text_of = lambda i: orth_text[orth_index[i]] if i >= 0 else ""
+    lemma_of = lambda i: lemma_lower[lemma_index[i]] if i >= 0 else ""
+    datalist = []
+
+    for i, (subject, skipped, verb, modal, helping_verb, ter_child, que_child, auxillary_child, neg, passive_subject) in \
+            enumerate(zip(subjects.tolist(), arrays['is_que'][subjects].tolist(), verbs.tolist(), modals.tolist(),
+                          helping_verbs.tolist(), arrays['first_ter_child'][verbs].tolist(),
+                          arrays['has_que_child'][verbs].tolist(), arrays['last_auxillary_child'][verbs].tolist(),
+                          negated.tolist(), arrays['is_passive_subject'][subjects].tolist())):
+        # checks for subject 'que' and skips it
+        if skipped:
+            continue
+
+        mlem, hlem = lemma_of(modal), lemma_of(helping_verb)
+        modal_text, helping_verb_text = text_of(modal), text_of(helping_verb)
+
+        # checks for 'ter que' and 'ter de'
+        if not mlem and ter_child >= 0 and que_child:
+            modal_text, mlem = text_of(ter_child) + ' que', 'ter que'
+
+        # checks for forms of 'ir,' 'haver,' and 'ter' modifying verb
+        if not hlem and mlem != 'ter que' and auxillary_child >= 0:
+            helping_verb_text, hlem = text_of(auxillary_child), lemma_of(auxillary_child)
+
+        # data structure to store clause information
+        data = {'subject': text_of(subject),
+                'slem': lemma_of(subject),
+                'neg': 'não' if neg else '',
+                'modal': modal_text,
+                'mlem': mlem,
+                'helping_verb': helping_verb_text,
+                'hlem': hlem,
+                'verb': text_of(verb),
+                'vlem': lemma_of(verb),
+                'passive': 0,
+                'md': 0}
+        if complete_statement(data, passive_subject, nlp) is None:
+            print(get_sentence(i))
+            continue
+        datalist.append((i, data))
+
+    return datalist
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_directory", type=str, default="")
     parser.add_argument("--output_directory", type=str, default="")
     parser.add_argument("--clause", action='store_true')
+    parser.add_argument("--pipe", action='store_true')
+    parser.add_argument("--batch_size", type=int, default=50)
+    parser.add_argument("--n_process", type=int, default=1)
+    parser.add_argument("--force", action='store_true')
+    parser.add_argument("--lemma_cache", type=str, default="")
+    parser.add_argument("--lemma_cache_size", type=int, default=100000)
+    parser.add_argument("--save_docs", action='store_true')
+    parser.add_argument("--reuse_parses", action='store_true')
+    parser.add_argument("--rule_engine", type=str, default="token", choices=["token", "array", "check"])
+    parser.add_argument("--parsed_format", type=str, default="pkl", choices=["pkl", "arrow"])
+    parser.add_argument("--max_chars", type=int, default=100000)
+    parser.add_argument("--isolate", action="store_true")
+    parser.add_argument("--doc_timeout", type=float, default=600)
+    parser.add_argument("--max_memory_mb", type=int, default=0)
+    parser.add_argument("--max_retries", type=int, default=1)
+    parser.add_argument("--resume", action='store_true')
+    parser.add_argument("--shard", type=parse_shard, default=None)
     args = parser.parse_args()
 
     try:
@@ -267,5 +1069,4 @@ if __name__ == "__main__":
         pass
 
     nlp = spacy.load('pt_core_news_sm', disable=["ner"])
-    for filename in tqdm(os.listdir(args.input_directory)):
-        parse_article(filename, nlp, args)
+    parse_articles(os.listdir(args.input_directory), nlp, args)
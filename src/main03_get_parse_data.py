@@ -1,19 +1,105 @@
 import argparse
 from collections import Counter
+from functools import partial
+from multiprocessing import Pool
 import os
 import pandas as pd
 import joblib
 import io
 import json
 from tqdm import tqdm
+from atomic_io import atomic_path, is_temp_file
+from vocab import apply_vocab, get_categorical_memory, get_vocab_columns, report_memory_saved, save_vocab, update_vocab
+from columnar import (PdataWriter, compact_table, concat_pdata, count_row_groups, count_values, decode_strings, 
+                      iter_row_chunks, pdata_fields, pdata_table, read_pdata_row_group, read_statements)
 
 # command to run the file in the terminal
 # python src/main03_get_parse_data.py --input_directory cleaned_cbas --output_directory output
-    
+
+# file of the parsed data when it is saved as Parquet, in the '03_pdata' directory
+pdata_parquet_filename = "pdata.parquet"
+
+def list_pdata_chunks(args):
+    """
+    Lists the chunks of parsed data saved by extract_pdata, in order: the pdata_{n}.pkl files, or the row 
+    groups of the Parquet file (named pdata_{n}) with '--pdata_format parquet'.
+
+    Args:
+        args: object containing the required arguments and settings
+
+    Returns:
+        list of chunk names
+    """
+    pdata_directory = os.path.join(args.output_directory, "03_pdata")
+    if args.pdata_format == "parquet":
+        num_row_groups = count_row_groups(os.path.join(pdata_directory, pdata_parquet_filename))
+        return ["pdata_" + str(n) for n in range(num_row_groups)]
+    chunks = [fn for fn in os.listdir(pdata_directory) if fn.endswith(".pkl")]
+    return sorted(chunks, key=get_chunk_number)
+
+def save_pdata_chunk(df, chunk_num, args):
+    """
+    Saves a chunk of parsed data as pdata_{chunk_num}.pkl, atomically so that an interrupted run leaves no
+    half-written chunk. The vocabulary columns are saved as categoricals with the categories of the chunk, 
+    since the vocabulary is only complete after the last chunk; read_pdata_chunk converts them to the shared 
+    categories.
+
+    Args:
+        df: DataFrame of parsed data
+        chunk_num: number of the chunk
+        args: object containing the required arguments and settings
+
+    Returns:
+        tuple of the memory used by the categorical columns of the chunk and as object columns
+    """
+    if len(df.columns) == 0:
+        # a chunk without rows (e.g. of a shard without statements) still has the parsed data columns
+        df = pd.DataFrame(columns=pdata_fields + (['clause_name'] if args.clause else []))
+    df = df.astype({column: 'category' for column in get_vocab_columns(args.clause) if column in df})
+    with atomic_path(os.path.join(args.output_directory, "03_pdata", "pdata_" + str(chunk_num) + ".pkl")) as temp_fpath:
+        df.to_pickle(temp_fpath)
+    return get_categorical_memory(df)
+
+def get_chunk_number(chunk):
+    """
+    Gets the number of a chunk of parsed data or authority data from its name.
+
+    Args:
+        chunk: chunk name, e.g. 'pdata_3.pkl' or 'pdata_3'
+
+    Returns:
+        int
+    """
+    return int(os.path.splitext(chunk)[0].split("_")[-1])
+
+def read_pdata_chunk(args, chunk, columns=None, vocab=None):
+    """
+    Loads a chunk of parsed data listed by list_pdata_chunks. Only the given columns are read from Parquet.
+
+    Args:
+        args: object containing the required arguments and settings
+        chunk: chunk name
+        columns: names of the columns to load, or None for all columns
+        vocab: categorical dtypes of the vocabulary columns (see vocab.load_vocab), or None to keep strings
+
+    Returns:
+        Pandas DataFrame
+    """
+    pdata_directory = os.path.join(args.output_directory, "03_pdata")
+    if args.pdata_format == "parquet":
+        df = read_pdata_row_group(os.path.join(pdata_directory, pdata_parquet_filename), get_chunk_number(chunk), columns)
+    else:
+        df = pd.read_pickle(os.path.join(pdata_directory, chunk))
+        df = df[columns] if columns is not None else df
+    return apply_vocab(df, vocab) if vocab else df
+
 def extract_pdata(args):
     """
     Extracts data from parsed articles and saves it into a Pandas DataFrame. Also produces text files with 
-    counts of occurrences of modal verbs, subjects, and verbs lemmatized. 
+    counts of occurrences of modal verbs, subjects, and verbs lemmatized, and the vocabulary of the columns 
+    that later stages load as categoricals. Parsed articles are read in file name order. With 
+    '--pdata_format parquet', the data is streamed to a Parquet file instead. With '--jobs' greater than 1, 
+    the parsed articles are loaded by a pool of processes.
 
     Args:
         args: object containing the required arguments and settings
@@ -25,65 +111,223 @@ def extract_pdata(args):
     mlemcount = Counter()
     vlemcount = Counter()
     slemcount = Counter()
+    vocab = {column: set() for column in get_vocab_columns(args.clause)}
+    # memory of the vocabulary columns of each saved chunk as categoricals and as object columns
+    chunk_bytes = []
 
     iteration_num = 0
     chunk_num = 0
     pdata_rows = []
 
     # iterates through each clause and adds its data to Pandas DataFrame
-    files = os.listdir(os.path.join(args.output_directory, "02_parsed_articles"))
+    # skips the temporary files of a parse run that was interrupted while saving, and the files of the other 
+    # parsed format (e.g. left by an earlier run with another '--parsed_format')
+    extension = "." + args.parsed_format
+    files = sorted(fn for fn in os.listdir(os.path.join(args.output_directory, "02_parsed_articles")) 
+                   if fn.endswith(extension) and not is_temp_file(fn))
     filenames = [os.path.join(args.output_directory, "02_parsed_articles", fn) for fn in files]
-    for filename in tqdm(filenames, total=len(filenames)):
-        for statement_data in joblib.load(filename):
-            contract_id = statement_data["contract_id"]
-
-            statement_dict = {'contract_id':contract_id,
-                              'subject': statement_data['subject'], 'passive': statement_data['passive'],
-                              'helping_verb': statement_data['helping_verb'],
-                              'verb': statement_data['verb'], 'vlem': statement_data['vlem'], 
-                              'modal': statement_data['modal'], 'mlem': statement_data['mlem'],
-                              'md': statement_data['md'], 'neg': statement_data['neg'],
-                              'slem': statement_data['slem']}
-            if args.clause:
-                statement_dict['clause_name'] = statement_data['clause_name']
-
-            pdata_rows.append(statement_dict)
-
-            vlemcount[statement_dict['vlem']] += 1
-            mlemcount[statement_dict['mlem']] += 1
-            slemcount[statement_dict['slem']] += 1
+    if args.jobs > 1:
+        chunk_bytes = extract_pdata_parallel(filenames, mlemcount, vlemcount, slemcount, vocab, args)
+    elif args.pdata_format == "parquet":
+        extract_pdata_parquet(filenames, mlemcount, vlemcount, slemcount, vocab, args)
+    elif args.parsed_format == "arrow":
+        chunk_bytes = extract_pdata_arrow(filenames, mlemcount, vlemcount, slemcount, vocab, args)
+    else:
+        for filename in tqdm(filenames, total=len(filenames)):
+            for statement_data in joblib.load(filename):
+                contract_id = statement_data["contract_id"]
+
+                statement_dict = {'contract_id':contract_id,
+                                  'subject': statement_data['subject'], 'passive': statement_data['passive'],
+                                  'helping_verb': statement_data['helping_verb'],
+                                  'verb': statement_data['verb'], 'vlem': statement_data['vlem'], 
+                                  'modal': statement_data['modal'], 'mlem': statement_data['mlem'],
+                                  'md': statement_data['md'], 'neg': statement_data['neg'],
+                                  'slem': statement_data['slem']}
+                if args.clause:
+                    statement_dict['clause_name'] = statement_data['clause_name']
+
+                pdata_rows.append(statement_dict)
+
+                vlemcount[statement_dict['vlem']] += 1
+                mlemcount[statement_dict['mlem']] += 1
+                slemcount[statement_dict['slem']] += 1
             
-            iteration_num = iteration_num + 1
-            if iteration_num % 100000 == 0:
-                cur_df = pd.DataFrame(pdata_rows)
-                cur_df.to_pickle(os.path.join(args.output_directory, "03_pdata", "pdata_" + str(chunk_num) + ".pkl"))
-                chunk_num += 1
-                pdata_rows.clear()
+                iteration_num = iteration_num + 1
+                if iteration_num % 100000 == 0:
+                    cur_df = pd.DataFrame(pdata_rows)
+                    update_vocab(vocab, cur_df)
+                    chunk_bytes.append(save_pdata_chunk(cur_df, chunk_num, args))
+                    chunk_num += 1
+                    pdata_rows.clear()
+
+        # makes a Pandas DataFrame from what is left and saves it
+        cur_df = pd.DataFrame(pdata_rows)
+        update_vocab(vocab, cur_df)
+        chunk_bytes.append(save_pdata_chunk(cur_df, chunk_num, args))
 
-    # makes a Pandas DataFrame from what is left and saves it
-    cur_df = pd.DataFrame(pdata_rows)
-    cur_df.to_pickle(os.path.join(args.output_directory, "03_pdata", "pdata_" + str(chunk_num) + ".pkl"))
+    save_vocab(vocab, args)
+    # the Parquet file of '--pdata_format parquet' is dictionary-encoded by pyarrow instead
+    if chunk_bytes:
+        report_memory_saved("03_pdata chunks", sum(b[0] for b in chunk_bytes), sum(b[1] for b in chunk_bytes))
 
     # creates text files for counts of modals, subjects, and verbs lemmatized
     slem_counts_filename = os.path.join(args.output_directory, "slem_counts.txt")
     # joblib.dump(slemcount, slem_counts_filename)    
-    with io.open(slem_counts_filename, 'w', encoding='utf-8') as f:
-        json.dump(slemcount.most_common(), f, ensure_ascii=False)
+    with atomic_path(slem_counts_filename) as temp_fpath:
+        with io.open(temp_fpath, 'w', encoding='utf-8') as f:
+            json.dump(slemcount.most_common(), f, ensure_ascii=False)
     vlem_counts_filename = os.path.join(args.output_directory, "vlem_counts.txt")
     # joblib.dump(vlemcount, vlem_counts_filename)    
-    with io.open(vlem_counts_filename, 'w', encoding='utf-8') as f:
-        json.dump(vlemcount.most_common(), f, ensure_ascii=False)
+    with atomic_path(vlem_counts_filename) as temp_fpath:
+        with io.open(temp_fpath, 'w', encoding='utf-8') as f:
+            json.dump(vlemcount.most_common(), f, ensure_ascii=False)
     mlem_counts_filename = os.path.join(args.output_directory, "mlem_counts.txt")
     # joblib.dump(mlemcount, mlem_counts_filename)    
-    with io.open(mlem_counts_filename, 'w', encoding='utf-8') as f:
-        json.dump(mlemcount.most_common(), f, ensure_ascii=False)
+    with atomic_path(mlem_counts_filename) as temp_fpath:
+        with io.open(temp_fpath, 'w', encoding='utf-8') as f:
+            json.dump(mlemcount.most_common(), f, ensure_ascii=False)
+
+def extract_pdata_arrow(filenames, mlemcount, vlemcount, slemcount, vocab, args):
+    """
+    Extracts data from parsed articles saved as Arrow files into the same 100,000 statement chunks as 
+    extract_pdata, and updates the lemma counters from the table columns.
+
+    Args:
+        filenames: paths of the Arrow files in the '02_parsed_articles' directory
+        mlemcount: counter of modal lemmas
+        vlemcount: counter of verb lemmas
+        slemcount: counter of subject lemmas
+        vocab: sets of values of the vocabulary columns, updated in place
+        args: object containing the required arguments and settings
+
+    Returns:
+        list of the memory used by the categorical columns of each chunk and as object columns
+    """
+    columns = list(pdata_fields)
+    if args.clause:
+        columns.append('clause_name')
+
+    table = read_statements(filenames)
+    num_rows = table.num_rows if table is not None else 0
+    chunk_bytes = []
+    for chunk_num in range(num_rows // 100000 + 1):
+        chunk = table.slice(chunk_num * 100000, 100000) if table is not None else None
+        if chunk is not None and chunk.num_rows:
+            cur_df = decode_strings(chunk.select(columns)).to_pandas()
+            update_vocab(vocab, cur_df)
+        else:
+            cur_df = pd.DataFrame()
+        chunk_bytes.append(save_pdata_chunk(cur_df, chunk_num, args))
+
+    if table is not None:
+        for column, counter in [('vlem', vlemcount), ('mlem', mlemcount), ('slem', slemcount)]:
+            counter.update(table.column(column).to_pylist())
+    return chunk_bytes
+
+def extract_pdata_parquet(filenames, mlemcount, vlemcount, slemcount, vocab, args):
+    """
+    Streams data from parsed articles to the Parquet file of stage 03 one article file at a time, in row 
+    groups of '--row_group_size' statements, and updates the lemma counters from the columns.
+
+    Args:
+        filenames: paths of the files in the '02_parsed_articles' directory
+        mlemcount: counter of modal lemmas
+        vlemcount: counter of verb lemmas
+        slemcount: counter of subject lemmas
+        vocab: sets of values of the vocabulary columns, updated in place
+        args: object containing the required arguments and settings
+
+    Returns:
+        None
+    """
+    filepath = os.path.join(args.output_directory, "03_pdata", pdata_parquet_filename)
+    with atomic_path(filepath) as temp_fpath, PdataWriter(temp_fpath, args.clause, args.row_group_size) as writer:
+        for filename in tqdm(filenames, total=len(filenames)):
+            if args.parsed_format == "arrow":
+                table = read_statements([filename])
+                writer.write_table(table)
+            else:
+                table = writer.write_rows(joblib.load(filename))
+            update_vocab(vocab, table)
+            for column, counter in [('vlem', vlemcount), ('mlem', mlemcount), ('slem', slemcount)]:
+                counter.update(table.column(column).to_pylist())
+
+def load_parsed_shard(filenames, args):
+    """
+    Loads a shard of parsed article files into a single table of parsed data and counts its lemmas.
+
+    Args:
+        filenames: paths of files in the '02_parsed_articles' directory
+        args: object containing the required arguments and settings
+
+    Returns:
+        tuple of the pyarrow.Table of parsed data and a dictionary of Counters of the 'vlem', 'mlem', and
+        'slem' columns
+    """
+    tables = []
+    for filename in filenames:
+        statements = read_statements([filename]) if args.parsed_format == "arrow" else joblib.load(filename)
+        tables.append(pdata_table(statements, args.clause))
+    table = compact_table(concat_pdata(tables, args.clause))
+    counts = {column: count_values(table.column(column)) for column in ['vlem', 'mlem', 'slem']}
+    return table, counts
+
+def extract_pdata_parallel(filenames, mlemcount, vlemcount, slemcount, vocab, args):
+    """
+    Extracts data from parsed articles with a pool of '--jobs' processes. Each process loads a shard of 
+    consecutive files and counts its lemmas (see load_parsed_shard). The shards are merged in file order, 
+    so the chunks and counts are the same as when the files are loaded one at a time.
+
+    Args:
+        filenames: paths of the files in the '02_parsed_articles' directory
+        mlemcount: counter of modal lemmas
+        vlemcount: counter of verb lemmas
+        slemcount: counter of subject lemmas
+        vocab: sets of values of the vocabulary columns, updated in place
+        args: object containing the required arguments and settings
+
+    Returns:
+        list of the memory used by the categorical columns of each pdata_{n}.pkl chunk and as object columns,
+        empty with '--pdata_format parquet'
+    """
+    # several shards per process balance the load between processes
+    shard_size = max(1, -(-len(filenames) // (args.jobs * 4)))
+    shards = [filenames[i:i + shard_size] for i in range(0, len(filenames), shard_size)]
+
+    def merge_shards(results):
+        # counts are merged in file order so that ties in most_common keep the order of first appearance
+        for table, counts in tqdm(results, total=len(shards)):
+            vlemcount.update(counts['vlem'])
+            mlemcount.update(counts['mlem'])
+            slemcount.update(counts['slem'])
+            update_vocab(vocab, table)
+            yield table
 
+    chunk_bytes = []
+    with Pool(args.jobs) as pool:
+        tables = merge_shards(pool.imap(partial(load_parsed_shard, args=args), shards))
+        if args.pdata_format == "parquet":
+            filepath = os.path.join(args.output_directory, "03_pdata", pdata_parquet_filename)
+            with atomic_path(filepath) as temp_fpath, PdataWriter(temp_fpath, args.clause, args.row_group_size) as writer:
+                for table in tables:
+                    writer.write_table(table)
+        else:
+            tables = tables if shards else [concat_pdata([], args.clause)]
+            for chunk_num, chunk in enumerate(iter_row_chunks(tables, 100000)):
+                cur_df = decode_strings(chunk).to_pandas() if chunk.num_rows else pd.DataFrame()
+                chunk_bytes.append(save_pdata_chunk(cur_df, chunk_num, args))
+    return chunk_bytes
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_directory", type=str, default="")
     parser.add_argument("--output_directory", type=str, default="")
     parser.add_argument("--clause", action='store_true')
+    parser.add_argument("--parsed_format", type=str, default="pkl", choices=["pkl", "arrow"])
+    parser.add_argument("--pdata_format", type=str, default="pkl", choices=["pkl", "parquet"])
+    parser.add_argument("--row_group_size", type=int, default=100000)
+    parser.add_argument("--jobs", type=int, default=1)
     args = parser.parse_args()
 
     try:
@@ -1,14 +1,44 @@
 import argparse
+from functools import lru_cache, partial
+import hashlib
+import inspect
+import io
+import json
+from multiprocessing import Pool
 import os
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
+from atomic_io import atomic_path
+from main03_get_parse_data import get_chunk_number, list_pdata_chunks, read_pdata_chunk
+from vocab import get_categorical_memory, load_vocab, report_memory_saved, vocab_filename
 
 # command to run the file in the terminal
 # python src/main04_compute_auth.py --input_directory cleaned_cbas --output_directory output
 
+# fingerprint of the inputs of the authority data of the last run, stored in the output directory
+fingerprint_filename = "04_fingerprint.json"
+
+def list_auth_chunks(args):
+    """
+    Lists the authority data chunks saved by compute_auth_chunks, in chunk order.
+
+    Arguments:
+        args: object containing the required arguments and settings
+
+    Returns:
+        list of paths of the chunk files
+    """
+    filepath = os.path.join(args.output_directory, "04_auth")
+    chunks = [fn for fn in os.listdir(filepath) if fn.startswith("auth_") and fn.endswith(".pkl")]
+    chunks = sorted(chunks, key=get_chunk_number)
+    return [os.path.join(filepath, filename) for filename in chunks]
+
 def combine_auth(args):
     """
-    Combines authority data chunks into a single DataFrame and saves it.
+    Combines authority data chunks into a single DataFrame and saves it. The chunks are concatenated at 
+    once rather than one by one, which would copy the rows combined so far for every chunk. With the 
+    '--skip_auth_combine' flag, no combined file is saved, and later stages read the chunks (see load_auth).
 
     Arguments:
         args: object containing the required arguments and settings
@@ -16,16 +46,65 @@ def combine_auth(args):
     Returns:
         None
     """
-    filepath = os.path.join(args.output_directory, "04_auth")
-    chunks = os.listdir(filepath)
-    chunks = sorted(chunks, key=lambda x: int(x.split("_")[-1][:-4]))
+    auth_fpath = os.path.join(args.output_directory, "04_auth.pkl")
+    if args.skip_auth_combine:
+        # removes the combined file of an earlier run so that it cannot be mistaken for this run's
+        if os.path.exists(auth_fpath):
+            os.remove(auth_fpath)
+        return
+
+    chunks = [pd.read_pickle(filepath) for filepath in list_auth_chunks(args)]
+    auth_df = pd.concat(chunks) if chunks else pd.DataFrame()
+    del chunks
+
+    report_memory_saved("04_auth.pkl", *get_categorical_memory(auth_df))
+    with atomic_path(auth_fpath) as temp_fpath:
+        auth_df.to_pickle(temp_fpath)
+
+def select_auth_columns(df, columns=None):
+    """
+    Keeps the given columns of authority data, and the packed flags if there are any.
+
+    Arguments:
+        df: DataFrame with authority data
+        columns: names of the columns to keep, or None for all columns
 
-    auth_df = pd.DataFrame()
-    for filename in chunks:
-        cur_df = pd.read_pickle(os.path.join(filepath, filename))
-        auth_df = pd.concat([auth_df,cur_df])
+    Returns:
+        DataFrame
+    """
+    return df if columns is None else df[[column for column in df.columns if column in columns or column == 'flags']]
 
-    auth_df.to_pickle(os.path.join(args.output_directory, "04_auth.pkl"))
+def iter_auth_chunks(args, columns=None):
+    """
+    Loads the authority data chunks one at a time, keeping only the given columns and the packed flags.
+
+    Arguments:
+        args: object containing the required arguments and settings
+        columns: names of the columns to keep, or None for all columns
+
+    Returns:
+        generator of DataFrames, in chunk order
+    """
+    for filepath in list_auth_chunks(args):
+        yield select_auth_columns(pd.read_pickle(filepath), columns)
+
+def load_auth(args, columns=None):
+    """
+    Loads the authority data from 04_auth.pkl or, with the '--skip_auth_combine' flag, from its chunks. 
+    Only the given columns, and the packed flags if there are any, are kept from each chunk, so the full
+    data is never held in memory.
+
+    Arguments:
+        args: object containing the required arguments and settings
+        columns: names of the columns to keep, or None for all columns
+
+    Returns:
+        DataFrame with the authority data
+    """
+    if not args.skip_auth_combine:
+        return select_auth_columns(pd.read_pickle(os.path.join(args.output_directory, "04_auth.pkl")), columns)
+    chunks = list(iter_auth_chunks(args, columns))
+    return pd.concat(chunks) if chunks else pd.DataFrame()
 
 # agent dictionaries
 worker = ['admitida', 'admitidas', 'admitido', 'admitidos', 'aposentada', 'aposentadas', 'aposentado', 'aposentados', 
@@ -55,6 +134,9 @@ manager = ['chefe', 'chefes', 'diretor', 'diretora', 'diretoras', 'diretores', '
            'superintendência', 'superintendente', 'superintendentes', 'supervisor', 'supervisora', 'supervisoras', 'supervisores',
            'conselho', 'conselhos']
 
+# categories of normalized subjects, sorted as when they are grouped as strings
+subnorm_dtype = pd.CategoricalDtype(sorted(['worker', 'firm', 'union', 'manager', 'other_agent']))
+
 # hash map from possible agents to category
 subnorm_map = {}
 for i in worker:
@@ -66,6 +148,29 @@ for i in union:
 for i in manager:
     subnorm_map[i] = "manager"
 
+# default lexicon of obligation, constraint, permission, entitlement, promise, and negative verbs
+lexicon_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), "verb_lexicon.json")
+
+@lru_cache(maxsize=None)
+def load_lexicon(filepath):
+    """
+    Loads the verb lists of a lexicon file, which maps each verb type to the lemmas of the verbs of that type in
+    the active and in the passive voice. The lists are loaded once per file and process.
+
+    Arguments:
+        filepath: path of the lexicon file, or an empty string for the default lexicon
+
+    Returns:
+        dictionary mapping each verb type to a dictionary with the frozensets of 'active' and 'passive' verbs
+    """
+    with io.open(filepath or lexicon_filename, 'r', encoding='utf-8') as f:
+        lexicon = json.load(f)
+    return {verb_type: {voice: frozenset(voices.get(voice, [])) for voice in ['active', 'passive']} 
+            for verb_type, voices in lexicon.items()}
+
+# modal verbs that make a statement an obligation rather than a permission
+strict_modals = {'dever', 'deverá', 'deverão', 'deve', 'devem', 'ter que', 'ir'}
+
 def normalize_subject(subject):
     """
     Normalizes a subject by mapping it to agent category.
@@ -91,9 +196,40 @@ def check_strict_modal(statement_row):
     Returns:
         True if the statement row contains a strict modal verb, False otherwise.
     """
-    strict_modals = {'dever', 'deverá', 'deverão', 'deve', 'devem', 'ter que', 'ir'}
     return statement_row['md'] and statement_row['mlem'] in strict_modals
 
+def normalize_subjects(slem):
+    """
+    Normalizes a column of subjects, like normalize_subject, mapping each distinct subject only once.
+
+    Arguments:
+        slem: Series of subject lemmas
+
+    Returns:
+        Categorical Series of agent categories, with the categories of subnorm_dtype
+    """
+    codes, uniques = pd.factorize(slem)
+    category_codes = subnorm_dtype.categories.get_indexer([normalize_subject(subject) for subject in uniques])
+    # missing subjects have the code -1 and are mapped to the last element
+    category_codes = np.append(category_codes, subnorm_dtype.categories.get_loc("other_agent"))
+    return pd.Series(pd.Categorical.from_codes(category_codes[codes], dtype=subnorm_dtype), index=slem.index)
+
+def check_strict_modals(md, mlem):
+    """
+    Checks which statements contain a strict modal verb, like check_strict_modal, testing each distinct 
+    modal lemma only once.
+
+    Arguments:
+        md: boolean Series, whether each statement contains a modal verb
+        mlem: Series of modal lemmas
+
+    Returns:
+        boolean Series
+    """
+    codes, uniques = pd.factorize(mlem)
+    is_strict = np.append(np.asarray(uniques.isin(strict_modals), dtype=bool), False)
+    return md & is_strict[codes]
+
 def check_neg(statement_row):
     """
     Checks if a statement row contains a negation.
@@ -106,33 +242,84 @@ def check_neg(statement_row):
     """
     return statement_row['neg'] == 'não'
 
-def compute_statement_auth(args, df, filename):
+def get_pdata_columns(args):
     """
-    Computes the authority of each statement in the given DataFrame.
+    Lists the columns of the parsed data that are needed to compute the authority measures.
 
     Arguments:
         args: object containing additional arguments or configuration settings
-        df: DataFrame containing the statement data
-        filename: filename of the output file
 
     Returns:
-        None
+        list of column names
     """
     if args.clause:
-        vars_to_keep = ["contract_id", "clause_name", "slem", "subject", "verb", "vlem",
-                        "modal", "mlem", "md", "helping_verb", "passive", "neg"]
-    else:
-        vars_to_keep = ["contract_id", "slem", "subject", "verb", "vlem",
-                        "modal", "mlem", "md", "helping_verb", "passive", "neg"] 
+        return ["contract_id", "clause_name", "slem", "subject", "verb", "vlem",
+                "modal", "mlem", "md", "helping_verb", "passive", "neg"]
+    return ["contract_id", "slem", "subject", "verb", "vlem",
+            "modal", "mlem", "md", "helping_verb", "passive", "neg"]
+
+# boolean columns of the authority data, in the order of their bits in the packed 'flags' column
+provision_flags = ['md', 'passive', 'neg', 'strict_modal', 'permissive_modal', 'obligation_verb', 'constraint_verb',
+                   'permission_verb', 'entitlement_verb', 'promise_verb', 'negative_verb', 'special_verb', 'active_verb',
+                   'obligation_1', 'obligation_2', 'obligation', 'constraint_1', 'constraint_2', 'constraint_3', 'constraint',
+                   'permission_1', 'permission_2', 'permission_3', 'permission', 'entitlement_1', 'entitlement_2',
+                   'entitlement_3', 'entitlement', 'other_provision']
+
+def pack_flags(df):
+    """
+    Replaces the boolean columns of authority data with a single 'flags' column, in which bit i holds the
+    value of provision_flags[i].
 
-    df = df[vars_to_keep]
-    df["md"] = df["md"].astype('bool')
-    df["passive"] = df["passive"].astype('bool')
-    df["subject"] = df["subject"].str.lower()
-    df["subnorm"] = df["slem"].apply(normalize_subject)
-    df["strict_modal"] = df.apply(check_strict_modal, axis=1).astype('bool')
-    df["neg"] = df['neg'].apply(lambda x: x == 'não').astype('bool')
+    Arguments:
+        df: DataFrame with the boolean columns in provision_flags
 
+    Returns:
+        DataFrame without the boolean columns and with a uint32 'flags' column
+    """
+    flags = np.zeros(len(df), dtype=np.uint32)
+    for bit, name in enumerate(provision_flags):
+        flags |= df[name].to_numpy(dtype=np.uint32) << np.uint32(bit)
+    df = df.drop(columns=provision_flags)
+    df['flags'] = flags
+    return df
+
+def has_flag(flags, name):
+    """
+    Tests one bit of packed flags.
+
+    Arguments:
+        flags: Series or array of packed flags
+        name: name of the flag, one of provision_flags
+
+    Returns:
+        boolean numpy array
+    """
+    return ((np.asarray(flags) >> np.uint32(provision_flags.index(name))) & 1).astype(bool)
+
+def unpack_flags(df, names=provision_flags):
+    """
+    Expands selected flags of the packed 'flags' column into boolean columns.
+
+    Arguments:
+        df: DataFrame with a 'flags' column
+        names: names of the flags to expand
+
+    Returns:
+        DataFrame with a boolean column for each flag, with the index of df
+    """
+    return pd.DataFrame({name: has_flag(df['flags'], name) for name in names}, index=df.index)
+
+def classify_statements(df, lexicon):
+    """
+    Classifies statements into verb, modal, and provision types, adding a boolean column for each type.
+
+    Arguments:
+        df: DataFrame with the 'vlem' column and the boolean 'md', 'passive', 'neg', and 'strict_modal' columns
+        lexicon: verb lists of the lexicon (see load_lexicon)
+
+    Returns:
+        DataFrame with the added columns
+    """
     # permissive modals are may and can
     df['permissive_modal'] = (df['md'] & ~df['strict_modal']).astype('bool')
 
@@ -141,32 +328,11 @@ def compute_statement_auth(args, df, filename):
     df_neg = df['neg']
     df_notneg = ~df_neg
 
-    # obligation verbs 
-    df['obligation_verb'] = ((df_passive & df['vlem'].isin({'exigir', 'esperar', 'coagir', 'compelir', 'obrigar', 'obrigado',
-                                                            'forçar', 'requerer', 'comprometar', 'comprometer', 'responsabilizar'})) 
-                             | (df_notpassive & df['vlem'].isin({'garantir', 'assegurar'}))).astype('bool')
-
-    # constraint verbs 
-    df['constraint_verb'] = (df_passive & df['vlem'].isin({'proibir', 'vedar', 'banir', 'impedir', 'impeder', 'restringir', 'proscrever', 
-                                                           'limitar', 'impossibilitar', 'negar', 'abster'})).astype('bool')
-        
-    # permissiion verbs
-    df['permission_verb'] = (df_passive & df['vlem'].isin({'permitir', 'autorizar', 'aprovar', 'habilitar'})).astype('bool')
-
-    # entitlement verbs    
-    df['entitlement_verb'] =  ((df_notpassive & df['vlem'].isin({'ter', 'receber', 'ganhar', 'obter', 'gozar', 'beneficiar', 'repousar'}))
-                               | (df_passive & df['vlem'].isin({'conceder', 'dar', 'outorgar', 'fornecer', 'garantir', 'garantido', 
-                                                                'proteger', 'cobrir', 'informar', 'notificar', 'assegurar',
-                                                                'facultar', 'proporcionar', 'prestar', 'propiciar', 'providenciar', 
-                                                                'fornecir', 'avisar'}))).astype('bool')
-
-    # promise verbs
-    df['promise_verb'] = (df_notpassive & df['vlem'].isin({'reconhecer', 'consentir', 'afirmar', 'segurar', 'estipular', 'assumir', 
-                                                            'concordar', 'prometer', 'aquiescer'})).astype('bool')
-
-    # negative verbs
-    df['negative_verb'] = ((df_notpassive & df['vlem'].isin({'trabalhar', 'sofrer', 'perder'})) 
-                           | df_passive & df['vlem'].isin({'despedir', 'despeder', 'dispensar', 'dispensado', 'dispensados'})).astype('bool') 
+    # obligation, constraint, permission, entitlement, promise, and negative verbs, in the voice given by the lexicon
+    for verb_type in ['obligation', 'constraint', 'permission', 'entitlement', 'promise', 'negative']:
+        verbs = lexicon[verb_type]
+        df[verb_type + '_verb'] = ((df_passive & df['vlem'].isin(verbs['passive'])) 
+                                   | (df_notpassive & df['vlem'].isin(verbs['active']))).astype('bool')
 
     # # verbs to be removed and classified as an 'other provision'
     # df['to_remove'] = (df_notpassive & df['vlem'].isin({'fazer', 'fará', 'farão', 'faz', 'fazem', 'estar', 'estará', 'estarão', 
@@ -203,8 +369,209 @@ def compute_statement_auth(args, df, filename):
     df['entitlement'] = (df['entitlement_1'] | df['entitlement_2'] | df['entitlement_3']).astype('bool')
 
     df['other_provision'] = ~(df['obligation'] | df['constraint'] | df['permission'] | df['entitlement']).astype('bool')
-    
-    df.to_pickle(os.path.join(args.output_directory, "04_auth", filename.replace("pdata_", "auth_")))
+
+    return df
+
+def classify_statements_by_key(df, lexicon):
+    """
+    Classifies statements like classify_statements, but only once per distinct combination of the columns
+    the classification depends on. The results are then broadcast back to the statements.
+
+    Arguments:
+        df: DataFrame with the 'vlem' column and the boolean 'md', 'passive', 'neg', and 'strict_modal' columns
+        lexicon: verb lists of the lexicon (see load_lexicon)
+
+    Returns:
+        DataFrame with the added columns
+    """
+    # the modal lemma only matters through 'strict_modal', which makes for fewer keys
+    key_columns = ['vlem', 'passive', 'neg', 'md', 'strict_modal']
+    key = np.zeros(len(df), dtype=np.int64)
+    column_uniques = []
+    for column in key_columns:
+        if df[column].dtype == bool:
+            codes, uniques = df[column].to_numpy(dtype=np.int64), np.array([False, True])
+        else:
+            codes, uniques = pd.factorize(df[column], use_na_sentinel=False)
+        key = key * len(uniques) + codes
+        column_uniques.append(uniques)
+    key_codes, keys = pd.factorize(key)
+
+    # decodes the distinct keys into the values of each column
+    key_values = {}
+    for column, uniques in reversed(list(zip(key_columns, column_uniques))):
+        keys, codes = np.divmod(keys, len(uniques))
+        key_values[column] = uniques.take(codes)
+    keys_df = classify_statements(pd.DataFrame({column: key_values[column] for column in key_columns}), lexicon)
+
+    type_columns = keys_df.columns.difference(key_columns, sort=False)
+    types = keys_df[type_columns].to_numpy(dtype=bool)[key_codes]
+    return pd.concat([df, pd.DataFrame(types, columns=type_columns, index=df.index)], axis=1)
+
+def compute_statement_auth(args, df, filename):
+    """
+    Computes the authority of each statement in the given DataFrame. With the '--pack_flags' flag, the 
+    boolean columns are saved packed into a single 'flags' column (see pack_flags).
+
+    Arguments:
+        args: object containing additional arguments or configuration settings
+        df: DataFrame containing the statement data
+        filename: name of the parsed data chunk, from which the output file is named
+
+    Returns:
+        DataFrame with the authority measures, as saved
+    """
+    vars_to_keep = get_pdata_columns(args)
+
+    df = df[vars_to_keep]
+    df["md"] = df["md"].astype('bool')
+    df["passive"] = df["passive"].astype('bool')
+    df["subject"] = df["subject"].str.lower()
+    if args.legacy_auth:
+        df["subnorm"] = df["slem"].apply(normalize_subject).astype(subnorm_dtype)
+        df["strict_modal"] = df.apply(check_strict_modal, axis=1).astype('bool')
+    else:
+        df["subnorm"] = normalize_subjects(df["slem"])
+        df["strict_modal"] = check_strict_modals(df["md"], df["mlem"])
+    if args.legacy_auth:
+        df["neg"] = df['neg'].apply(lambda x: x == 'não').astype('bool')
+    else:
+        df["neg"] = (df['neg'] == 'não').astype('bool')
+
+    lexicon = load_lexicon(args.lexicon)
+    if args.keyed_auth:
+        df = classify_statements_by_key(df, lexicon)
+    else:
+        df = classify_statements(df, lexicon)
+
+    if args.pack_flags:
+        df = pack_flags(df)
+    with atomic_path(os.path.join(args.output_directory, "04_auth", "auth_" + str(get_chunk_number(filename)) + ".pkl")) as temp_fpath:
+        df.to_pickle(temp_fpath)
+    return df
+
+def compute_auth_chunk(filename, args, vocab):
+    """
+    Loads a chunk of parsed data, then computes and saves its authority measures.
+
+    Arguments:
+        filename: name of the parsed data chunk
+        args: object containing additional arguments or configuration settings
+        vocab: categorical dtypes of the vocabulary columns
+
+    Returns:
+        tuple of the memory used by the categorical columns of the chunk and as object columns
+    """
+    cur_df = read_pdata_chunk(args, filename, get_pdata_columns(args), vocab)
+    return get_categorical_memory(compute_statement_auth(args, cur_df, filename))
+
+def compute_auth_chunks(args):
+    """
+    Computes the authority measures of each chunk of parsed data, in a pool of '--jobs' processes if more 
+    than one. Each chunk is saved to its own file, so the output does not depend on the number of processes.
+    The vocabulary columns are loaded as categoricals with the categories saved by stage 03, so that the 
+    chunks keep their categorical dtypes when they are combined.
+
+    Arguments:
+        args: object containing additional arguments or configuration settings
+
+    Returns:
+        None
+    """
+    # removes the chunks of an earlier run, which may have more chunks than this one
+    for filepath in list_auth_chunks(args):
+        os.remove(filepath)
+
+    vocab = load_vocab(args)
+    chunks = list_pdata_chunks(args)
+    compute_chunk = partial(compute_auth_chunk, args=args, vocab=vocab)
+    if args.jobs > 1:
+        with Pool(args.jobs) as pool:
+            chunk_bytes = list(tqdm(pool.imap(compute_chunk, chunks), total=len(chunks)))
+    else:
+        chunk_bytes = [compute_chunk(filename) for filename in tqdm(chunks)]
+    report_memory_saved("04_auth chunks", sum(b[0] for b in chunk_bytes), sum(b[1] for b in chunk_bytes))
+
+
+def hash_json(value):
+    """
+    Hashes a JSON-serializable value.
+
+    Arguments:
+        value: value to hash
+
+    Returns:
+        str, the first 10 hexadecimal digits of the SHA-1 digest of the value as JSON
+    """
+    text = json.dumps(value, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:10]
+
+def get_auth_fingerprint(args):
+    """
+    Fingerprints everything the authority data depends on: the agent lists, the strict modals, the verb
+    lexicon, the source of the functions applying the rules, the files of the parsed data of stage 03 (by
+    name, size, and modification time), and the settings that change the saved data.
+
+    Arguments:
+        args: object containing the required arguments and settings
+
+    Returns:
+        dictionary of hashes and settings
+    """
+    lexicon = load_lexicon(args.lexicon)
+    rule_functions = [normalize_subject, normalize_subjects, check_strict_modal, check_strict_modals, check_neg,
+                      classify_statements, classify_statements_by_key, compute_statement_auth]
+    pdata_directory = os.path.join(args.output_directory, "03_pdata")
+    filepaths = [os.path.join(pdata_directory, fn) for fn in sorted(os.listdir(pdata_directory))]
+    filepaths.append(os.path.join(args.output_directory, vocab_filename))
+    pdata_files = [[os.path.basename(fp), os.stat(fp).st_size, os.stat(fp).st_mtime_ns] for fp in filepaths
+                   if os.path.isfile(fp)]
+    return {
+        'agents': hash_json(sorted(subnorm_map.items())),
+        'modals': hash_json(sorted(strict_modals)),
+        'lexicon': hash_json({verb_type: {voice: sorted(verbs) for voice, verbs in voices.items()}
+                              for verb_type, voices in lexicon.items()}),
+        'rules': hash_json([inspect.getsource(function) for function in rule_functions]),
+        'pdata': hash_json(pdata_files),
+        'settings': {'clause': args.clause, 'pdata_format': args.pdata_format, 'pack_flags': args.pack_flags,
+                     'skip_auth_combine': args.skip_auth_combine}
+    }
+
+def save_auth_fingerprint(args):
+    """
+    Saves the fingerprint of the inputs of the authority data just computed to the output directory.
+
+    Arguments:
+        args: object containing the required arguments and settings
+
+    Returns:
+        None
+    """
+    fingerprint_fpath = os.path.join(args.output_directory, fingerprint_filename)
+    with atomic_path(fingerprint_fpath) as temp_fpath:
+        with io.open(temp_fpath, 'w', encoding='utf-8') as f:
+            json.dump(get_auth_fingerprint(args), f, indent=1, sort_keys=True)
+
+def find_changed_auth_inputs(args):
+    """
+    Compares the fingerprint of the inputs of the authority data with the one saved by the last run.
+
+    Arguments:
+        args: object containing the required arguments and settings
+
+    Returns:
+        list of the names of the inputs that changed, e.g. ['lexicon'], empty if the authority data is
+        up to date, or ['auth'] if the authority data of the last run is missing
+    """
+    fingerprint_fpath = os.path.join(args.output_directory, fingerprint_filename)
+    auth_fpath = os.path.join(args.output_directory, "04_auth.pkl")
+    if not os.path.exists(fingerprint_fpath) or not list_auth_chunks(args) \
+            or (not args.skip_auth_combine and not os.path.exists(auth_fpath)):
+        return ['auth']
+    with io.open(fingerprint_fpath, 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    current = get_auth_fingerprint(args)
+    return [name for name in current if saved.get(name) != current[name]]
 
 
 if __name__ == "__main__":
@@ -212,16 +579,24 @@ if __name__ == "__main__":
     parser.add_argument("--input_directory", type=str, default="")
     parser.add_argument("--output_directory", type=str, default="")
     parser.add_argument("--clause", action='store_true')
+    parser.add_argument("--pdata_format", type=str, default="pkl", choices=["pkl", "parquet"])
+    parser.add_argument("--legacy_auth", action='store_true')
+    parser.add_argument("--pack_flags", action='store_true')
+    parser.add_argument("--skip_auth_combine", action='store_true')
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--lexicon", type=str, default="")
+    parser.add_argument("--keyed_auth", action='store_true')
+    parser.add_argument("--rescore", action='store_true')
     args = parser.parse_args()
     
     try:
         os.mkdir(os.path.join(args.output_directory, "04_auth"))
     except:
         pass
-    chunks = os.listdir(os.path.join(args.output_directory, "03_pdata"))
-    chunks = sorted(chunks, key=lambda x: int(x.split("_")[-1][:-4]))
-    for filename in tqdm(chunks):
-        filepath = os.path.join(args.output_directory, "03_pdata", filename)
-        cur_df = pd.read_pickle(filepath)
-        compute_statement_auth(args, cur_df, filename)
-    combine_auth(args)
+    changed = find_changed_auth_inputs(args)
+    if args.rescore and not changed:
+        print("04_auth is up to date")
+    else:
+        compute_auth_chunks(args)
+        combine_auth(args)
+        save_auth_fingerprint(args)
@@ -0,0 +1,270 @@
+import argparse
+from collections import Counter
+import io
+import json
+import os
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from atomic_io import atomic_path
+from main02_parse_articles import get_contract_id, parsed_output_path
+from main04_compute_auth import combine_auth, list_auth_chunks
+from parse_cache import load_manifest
+from pipeline import Pipeline
+from sketches import load_sketches, save_sketches, sketches_filename
+from vocab import get_vocab_columns, load_vocab, save_vocab
+
+# command to run the file in the terminal, after running stages 02 to 04 with '--shard i/N' in each shard directory
+# python src/merge_shards.py --shard_directories output_0 output_1 output_2 --output_directory output
+
+# rows per authority data chunk, as in the parsed data chunks of stage 03 without '--pdata_format parquet'
+chunk_size = 100000
+
+# lemma count files of stage 03
+lemma_count_filenames = {'slem': "slem_counts.txt", 'vlem': "vlem_counts.txt", 'mlem': "mlem_counts.txt"}
+
+def shard_args(shard_directory, args):
+    """
+    Gives the arguments of the merge with the output directory of a shard.
+
+    Arguments:
+        shard_directory (str): output directory of the shard
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        argparse.Namespace
+    """
+    return argparse.Namespace(**dict(vars(args), output_directory=shard_directory))
+
+def get_contract_ranks(args):
+    """
+    Ranks the contracts of all shards in the order in which a single run reads their parsed files (sorted by
+    the name of the parsed file), from the manifests of the shards.
+
+    Arguments:
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        dictionary mapping each contract ID to its rank
+    """
+    parsed_names = {}
+    for shard_directory in args.shard_directories:
+        for filename in load_manifest(shard_args(shard_directory, args))['files']:
+            parsed_names[get_contract_id(filename)] = os.path.basename(parsed_output_path(filename, args))
+    ordered = sorted(parsed_names, key=parsed_names.get)
+    return {contract_id: rank for rank, contract_id in enumerate(ordered)}
+
+def merge_vocab(args):
+    """
+    Merges the vocabularies of the shards and saves the merged vocabulary.
+
+    Arguments:
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        dictionary of pandas.CategoricalDtype by column name
+    """
+    vocab = {column: set() for column in get_vocab_columns(args.clause)}
+    for shard_directory in args.shard_directories:
+        for column, dtype in load_vocab(shard_args(shard_directory, args)).items():
+            vocab[column].update(dtype.categories)
+    save_vocab(vocab, args)
+    return load_vocab(args)
+
+def iter_shard_auth(shard_directory, ranks, vocab, args):
+    """
+    Loads the authority data chunks of a shard one at a time, with the categories of the merged vocabulary.
+
+    Arguments:
+        shard_directory (str): output directory of the shard
+        ranks (dict): rank of each contract ID (see get_contract_ranks)
+        vocab (dict): categorical dtypes of the merged vocabulary
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        generator of (DataFrame, numpy array of the contract rank of each row) tuples, skipping empty chunks
+    """
+    for filepath in list_auth_chunks(shard_args(shard_directory, args)):
+        chunk = pd.read_pickle(filepath)
+        if len(chunk) == 0:
+            continue
+        columns = [column for column in vocab if column in chunk]
+        chunk = chunk.astype({column: object for column in columns}).astype({column: vocab[column] for column in columns})
+        yield chunk, chunk['contract_id'].astype(object).map(ranks).to_numpy(dtype=np.int64)
+
+def iter_merged_auth(ranks, vocab, args):
+    """
+    Merges the authority data of the shards in the order of a single run, holding about one chunk per shard in
+    memory. The statements of a contract all come from the same shard, in order, and each shard's statements
+    are sorted by contract rank, so all rows up to the smallest last rank buffered for any shard can be merged.
+
+    Arguments:
+        ranks (dict): rank of each contract ID (see get_contract_ranks)
+        vocab (dict): categorical dtypes of the merged vocabulary
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        generator of DataFrames of consecutive statements
+    """
+    streams = [iter_shard_auth(shard_directory, ranks, vocab, args) for shard_directory in args.shard_directories]
+    buffers = [next(stream, None) for stream in streams]
+    while any(buffer is not None for buffer in buffers):
+        limit = min(buffer[1][-1] for buffer in buffers if buffer is not None)
+        parts, part_ranks = [], []
+        for i, buffer in enumerate(buffers):
+            if buffer is None:
+                continue
+            chunk, chunk_ranks = buffer
+            num_rows = int(np.searchsorted(chunk_ranks, limit, side='right'))
+            parts.append(chunk.iloc[:num_rows])
+            part_ranks.append(chunk_ranks[:num_rows])
+            if num_rows < len(chunk):
+                buffers[i] = (chunk.iloc[num_rows:], chunk_ranks[num_rows:])
+            else:
+                buffers[i] = next(streams[i], None)
+        order = np.argsort(np.concatenate(part_ranks), kind='stable')
+        yield pd.concat(parts, ignore_index=True).iloc[order]
+
+def merge_auth(args):
+    """
+    Merges the authority data chunks of the shards. The statements are put back in the order of a single
+    run, cut into chunks of the same size (that of the parsed data chunks of stage 03, or '--row_group_size'
+    with '--pdata_format parquet'), and given the categories of the merged vocabulary, so that the chunks equal
+    those of a single run. The chunks are merged and written one at a time.
+
+    Arguments:
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        dictionary mapping each lemma column to its values in the order in which they first appear
+    """
+    vocab = merge_vocab(args)
+    ranks = get_contract_ranks(args)
+    rows_per_chunk = args.row_group_size if args.pdata_format == "parquet" else chunk_size
+    first_seen = {column: {} for column in lemma_count_filenames}
+
+    for filepath in list_auth_chunks(args):
+        os.remove(filepath)
+
+    def save_chunk(chunk, chunk_num):
+        chunk = chunk.reset_index(drop=True)
+        for column, seen in first_seen.items():
+            for value in chunk[column].astype(object).where(chunk[column].notna(), None).drop_duplicates():
+                seen.setdefault(value, len(seen))
+        with atomic_path(os.path.join(args.output_directory, "04_auth", f"auth_{chunk_num}.pkl")) as temp_fpath:
+            chunk.to_pickle(temp_fpath)
+
+    pending, num_pending, chunk_num = [], 0, 0
+    for rows in tqdm(iter_merged_auth(ranks, vocab, args)):
+        pending.append(rows)
+        num_pending += len(rows)
+        while num_pending >= rows_per_chunk:
+            rows = pd.concat(pending)
+            save_chunk(rows.iloc[:rows_per_chunk], chunk_num)
+            chunk_num += 1
+            pending, num_pending = [rows.iloc[rows_per_chunk:]], num_pending - rows_per_chunk
+    # stage 03 always saves a last pickled chunk with the remaining rows, which may be empty, while the Parquet
+    # file has no empty row group
+    if num_pending or args.pdata_format != "parquet":
+        if not pending:
+            # no shard has statements: the shards' empty chunks give the columns
+            pending = [pd.read_pickle(list_auth_chunks(shard_args(args.shard_directories[0], args))[0])]
+        save_chunk(pd.concat(pending), chunk_num)
+    combine_auth(args)
+    return first_seen
+
+def merge_lemma_counts(first_seen, args):
+    """
+    Sums the lemma counts of the shards. Lemmas with the same count are listed in the order in which they
+    first appear in the merged data, as in a single run.
+
+    Arguments:
+        first_seen (dict): values of each lemma column in the order in which they first appear in the merged data
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        None
+    """
+    for column, counts_filename in lemma_count_filenames.items():
+        counts = Counter()
+        for shard_directory in args.shard_directories:
+            with io.open(os.path.join(shard_directory, counts_filename), 'r', encoding='utf-8') as f:
+                counts.update(dict((lemma, count) for lemma, count in json.load(f)))
+        seen = first_seen[column]
+        ordered = Counter({lemma: counts[lemma] for lemma in sorted(counts, key=lambda lemma: seen.get(lemma, len(seen)))})
+        with atomic_path(os.path.join(args.output_directory, counts_filename)) as temp_fpath:
+            with io.open(temp_fpath, 'w', encoding='utf-8') as f:
+                json.dump(ordered.most_common(), f, ensure_ascii=False)
+
+def merge_aggregated(args):
+    """
+    Merges the 05_aggregated.csv files of the shards, summing the rows of each contract (and clause) and
+    sorting them as a single run does.
+
+    Arguments:
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        None
+    """
+    keys = ['contract_id', 'clause_name'] if args.clause else ['contract_id']
+    partials = [pd.read_csv(os.path.join(shard_directory, "05_aggregated.csv"), dtype={key: str for key in keys},
+                            keep_default_na=False) for shard_directory in args.shard_directories]
+    df = pd.concat(partials).groupby(keys, as_index=False).sum()
+    df.to_csv(os.path.join(args.output_directory, "05_aggregated.csv"), index=False)
+
+def merge_shards(args):
+    """
+    Merges the outputs of shards of the corpus into the outputs of a single run: the authority data chunks
+    (and 04_auth.pkl unless '--skip_auth_combine' is given), the vocabulary, the lemma counts, the subject verb
+    prefixes, and 05_aggregated.csv. The aggregated measures are merged from the shards' files when every shard
+    has one, and the prefix sketches likewise with '--prefix_mode sketch'; otherwise they are computed from the
+    merged authority data.
+
+    Arguments:
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        None
+    """
+    os.makedirs(os.path.join(args.output_directory, "04_auth"), exist_ok=True)
+    merge_lemma_counts(merge_auth(args), args)
+
+    pipeline = Pipeline(args)
+    has_all = lambda filename: all(os.path.exists(os.path.join(directory, filename)) for directory in args.shard_directories)
+    if args.prefix_mode == "sketch" and has_all(sketches_filename):
+        sketches = None
+        for shard_directory in args.shard_directories:
+            shard_sketches = load_sketches(os.path.join(shard_directory, sketches_filename))
+            if sketches is None:
+                sketches = shard_sketches
+            else:
+                for name, sketch in shard_sketches.items():
+                    sketches[name].merge(sketch)
+        save_sketches(sketches, os.path.join(args.output_directory, sketches_filename))
+        pipeline.save_sketched_prefixes(sketches)
+    else:
+        pipeline.determine_subject_verb_prefixes()
+
+    if has_all("05_aggregated.csv"):
+        merge_aggregated(args)
+    else:
+        pipeline.aggregate_measures()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shard_directories", type=str, nargs='+', required=True)
+    parser.add_argument("--output_directory", type=str, default="")
+    parser.add_argument("--clause", action='store_true')
+    parser.add_argument("--parsed_format", type=str, default="pkl", choices=["pkl", "arrow"])
+    parser.add_argument("--pdata_format", type=str, default="pkl", choices=["pkl", "parquet"])
+    parser.add_argument("--row_group_size", type=int, default=100000)
+    parser.add_argument("--skip_auth_combine", action='store_true')
+    parser.add_argument("--stream_aggregate", action='store_true')
+    parser.add_argument("--prefix_mode", type=str, default="legacy", choices=["legacy", "grouped", "sketch"])
+    parser.add_argument("--sketch_capacity", type=int, default=50000)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_directory, exist_ok=True)
+    merge_shards(args)
@@ -0,0 +1,189 @@
+import hashlib
+import io
+import json
+import os
+from atomic_io import atomic_path
+
+# manifest of parsed input files, stored in the output directory
+manifest_filename = "02_manifest.json"
+
+# journal of the input files parsed by the current run, stored in the output directory until the run completes
+journal_filename = "02_journal.jsonl"
+
+def hash_file(filepath):
+    """
+    Computes the SHA-256 hash of a file's contents.
+
+    Arguments:
+        filepath (str): path to the file
+
+    Returns:
+        str, hexadecimal digest of the file's contents
+    """
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def get_model_version(nlp):
+    """
+    Identifies a spaCy model by its language, name, and version.
+
+    Arguments:
+        nlp (spacy.Language): Spacy NLP model for text processing
+
+    Returns:
+        str, e.g. 'pt_core_news_sm-3.5.0'
+    """
+    return f"{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}"
+
+def load_manifest(args):
+    """
+    Loads the parse manifest from the output directory.
+
+    Arguments:
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        dictionary with the model, rules, and clause settings of the last run, and a 'files' dictionary
+        mapping each parsed file name to the hash of its contents
+    """
+    manifest_fpath = os.path.join(args.output_directory, manifest_filename)
+    if not os.path.exists(manifest_fpath):
+        return {'files': {}}
+    with io.open(manifest_fpath, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest, args):
+    """
+    Saves the parse manifest to the output directory.
+
+    Arguments:
+        manifest (dict): parse manifest
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        None
+    """
+    manifest_fpath = os.path.join(args.output_directory, manifest_filename)
+    with atomic_path(manifest_fpath) as temp_fpath:
+        with io.open(temp_fpath, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+
+def find_stale_files(filenames, manifest, settings, output_path, args):
+    """
+    Determines which input files have to be parsed again. A file is up to date when its hash and the
+    parse settings (model, rules, clause mode, segment size) match the manifest and its output file exists.
+
+    Arguments:
+        filenames (list): names of the input files
+        manifest (dict): parse manifest of the last run
+        settings (dict): parse settings of the current run
+        output_path (function): maps an input file name to the path of its output file
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        tuple of the list of file names to parse and a dictionary mapping every file name to its hash
+    """
+    same_settings = all(manifest.get(key) == value for key, value in settings.items())
+    hashes = {}
+    stale = []
+    for filename in filenames:
+        hashes[filename] = hash_file(os.path.join(args.input_directory, filename))
+        if not same_settings or manifest['files'].get(filename) != hashes[filename] \
+                or not os.path.exists(output_path(filename)):
+            stale.append(filename)
+    return stale, hashes
+
+def remove_deleted_outputs(filenames, output_directory, output_path, is_owned=None):
+    """
+    Removes output files whose input files no longer exist.
+
+    Arguments:
+        filenames (list): names of the current input files
+        output_directory (str): directory containing the output files
+        output_path (function): maps an input file name to the path of its output file
+        is_owned (function): tells whether an output file name belongs to the current run, e.g. to its shard,
+            or None if all of them do; other output files are kept
+
+    Returns:
+        int, number of removed output files
+    """
+    expected = {os.path.abspath(output_path(filename)) for filename in filenames}
+    removed = 0
+    for output_fname in os.listdir(output_directory):
+        output_fpath = os.path.abspath(os.path.join(output_directory, output_fname))
+        if output_fpath not in expected and (is_owned is None or is_owned(output_fname)):
+            os.remove(output_fpath)
+            removed += 1
+    return removed
+
+def start_journal(settings, args):
+    """
+    Starts the journal of the files parsed by the current run. With the '--resume' flag, the files journaled by 
+    an interrupted run with the same parse settings are kept; otherwise the journal starts empty.
+
+    Arguments:
+        settings (dict): parse settings of the current run
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        dictionary mapping the file names of the kept journal to the hashes of the parsed contents
+    """
+    journal_fpath = os.path.join(args.output_directory, journal_filename)
+    journaled = {}
+    if args.resume and os.path.exists(journal_fpath):
+        with io.open(journal_fpath, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # the last line may have been cut off when the run was interrupted
+                continue
+        if records and records[0].get('settings') == settings:
+            journaled = {record['filename']: record['hash'] for record in records[1:] if 'filename' in record}
+
+    with atomic_path(journal_fpath) as temp_fpath:
+        with io.open(temp_fpath, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'settings': settings}, ensure_ascii=False) + '\n')
+            for filename, file_hash in journaled.items():
+                f.write(json.dumps({'filename': filename, 'hash': file_hash}, ensure_ascii=False) + '\n')
+    return journaled
+
+def record_parsed(filename, args):
+    """
+    Adds a file whose outputs have been saved to the journal. The journal is opened for each record, so that 
+    worker processes can add records too.
+
+    Arguments:
+        filename (str): name of the input file
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        None
+    """
+    journal_fpath = os.path.join(args.output_directory, journal_filename)
+    if not os.path.exists(journal_fpath):
+        return
+    record = {'filename': filename, 'hash': hash_file(os.path.join(args.input_directory, filename))}
+    with io.open(journal_fpath, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def remove_journal(args):
+    """
+    Removes the journal once the run is complete and the manifest is saved.
+
+    Arguments:
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        None
+    """
+    journal_fpath = os.path.join(args.output_directory, journal_filename)
+    if os.path.exists(journal_fpath):
+        os.remove(journal_fpath)
@@ -0,0 +1,242 @@
+import io
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter, deque
+from queue import Empty
+from tqdm import tqdm
+from atomic_io import atomic_path
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# quarantine list of the input files that could not be parsed, stored in the output directory
+failures_filename = "02_failures.jsonl"
+
+def failure_record(filename, error, attempts):
+    """
+    Describes an input file that could not be parsed.
+
+    Arguments:
+        filename (str): name of the article file
+        error (str): description of the last error
+        attempts (int): number of times parsing the file was attempted
+
+    Returns:
+        dictionary with the file name, error, and number of attempts
+    """
+    return {'filename': filename, 'error': error, 'attempts': attempts}
+
+def parse_quarantined(parse_fn, filename, nlp, args, failures):
+    """
+    Parses an article file in the current process, recording the file as failed instead of stopping
+    the run if parsing raises an error.
+
+    Arguments:
+        parse_fn (function): parses and saves an article file, called as parse_fn(filename, nlp, args)
+        filename (str): name of the article file
+        nlp (spacy.Language): Spacy NLP model for text processing
+        args (argparse.Namespace): command-line arguments
+        failures (dict): failure records by file name, updated in place
+
+    Returns:
+        None
+    """
+    try:
+        parse_fn(filename, nlp, args)
+    except Exception as e:
+        failures[filename] = failure_record(filename, f"{type(e).__name__}: {e}", 1)
+
+def limit_memory(max_memory_mb):
+    """
+    Limits the address space of the current process, so that allocations beyond the limit raise a
+    MemoryError. Has no effect where the resource module is unavailable.
+
+    Arguments:
+        max_memory_mb (int): maximum address space in megabytes, or 0 for no limit
+
+    Returns:
+        None
+    """
+    if max_memory_mb and resource is not None:
+        limit = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def worker_loop(parse_fn, nlp, args, counts, tasks, results):
+    """
+    Parses the article files sent by the supervisor until it sends None. After each file, the worker
+    reports its process ID, the file name, the error (or None), and the counts accumulated while
+    parsing. A worker that runs out of memory exits after reporting, so that it is replaced.
+
+    Arguments:
+        parse_fn (function): parses and saves an article file, called as parse_fn(filename, nlp, args)
+        nlp (spacy.Language): Spacy NLP model for text processing
+        args (argparse.Namespace): command-line arguments
+        counts (collections.Counter): counts updated while parsing, reset after each report
+        tasks (multiprocessing.Queue): file names to parse
+        results (multiprocessing.Queue): reports to the supervisor
+
+    Returns:
+        None
+    """
+    limit_memory(args.max_memory_mb)
+    # a forked worker starts with a copy of the supervisor's counts, which the supervisor already has
+    counts.clear()
+    for filename in iter(tasks.get, None):
+        error = None
+        try:
+            parse_fn(filename, nlp, args)
+        except MemoryError:
+            error = "MemoryError: exceeded --max_memory_mb"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        results.put((os.getpid(), filename, error, dict(counts)))
+        counts.clear()
+        if error is not None and error.startswith("MemoryError"):
+            return
+
+class Worker():
+    """
+    Parsing process supervised by parse_isolated, with its own task queue and the file it is parsing.
+    """
+    def __init__(self, context, parse_fn, nlp, args, counts, results):
+        self.tasks = context.Queue()
+        self.process = context.Process(target=worker_loop, args=(parse_fn, nlp, args, counts, self.tasks, results),
+                                       daemon=True)
+        self.process.start()
+        self.filename = None
+        self.started = None
+
+    def assign(self, filename):
+        """
+        Sends a file to the worker and starts its timer.
+
+        Arguments:
+            filename (str): name of the article file
+
+        Returns:
+            None
+        """
+        self.filename = filename
+        self.started = time.monotonic()
+        self.tasks.put(filename)
+
+    def stop(self):
+        """
+        Asks the worker to exit once it is idle, or kills it if it is still parsing a file.
+
+        Returns:
+            None
+        """
+        if self.filename is None and self.process.is_alive():
+            self.tasks.put(None)
+        else:
+            self.process.kill()
+        self.process.join()
+
+def parse_isolated(filenames, parse_fn, nlp, args, counts):
+    """
+    Parses article files in supervised worker processes ('--n_process' of them). A file that raises an
+    error, takes longer than '--doc_timeout' seconds, or makes its worker exceed '--max_memory_mb' or
+    crash is retried up to '--max_retries' times and then quarantined. Killed or crashed workers are
+    replaced, so one pathological file does not stop the run.
+
+    Arguments:
+        filenames (list): names of the article files
+        parse_fn (function): parses and saves an article file, called as parse_fn(filename, nlp, args)
+        nlp (spacy.Language): Spacy NLP model for text processing
+        args (argparse.Namespace): command-line arguments
+        counts (collections.Counter): counts updated while parsing, merged from the workers
+
+    Returns:
+        dictionary of failure records by file name
+    """
+    # forked workers share the loaded model instead of loading it again
+    start_methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in start_methods else None)
+    results = context.Queue()
+    new_worker = lambda: Worker(context, parse_fn, nlp, args, counts, results)
+    workers = [new_worker() for _ in range(max(1, args.n_process))]
+
+    queue = deque(filenames)
+    attempts = Counter()
+    failures = {}
+    progress = tqdm(total=len(filenames))
+
+    def fail(filename, error):
+        attempts[filename] += 1
+        if attempts[filename] > args.max_retries:
+            failures[filename] = failure_record(filename, error, attempts[filename])
+            progress.update()
+        else:
+            queue.append(filename)
+
+    while queue or any(worker.filename is not None for worker in workers):
+        for worker in workers:
+            if worker.filename is None and queue:
+                worker.assign(queue.popleft())
+
+        # workers found dead before reading the results have already sent all of their reports
+        dead = [worker for worker in workers if not worker.process.is_alive()]
+        reports = []
+        try:
+            reports.append(results.get(timeout=1))
+            while True:
+                reports.append(results.get_nowait())
+        except Empty:
+            pass
+
+        for pid, filename, error, file_counts in reports:
+            counts.update(file_counts)
+            i = next((i for i, worker in enumerate(workers) if worker.process.pid == pid), None)
+            if i is None or workers[i].filename != filename:
+                continue
+            workers[i].filename = None
+            if error is None:
+                progress.update()
+                continue
+            fail(filename, error)
+            if error.startswith("MemoryError"):
+                workers[i].process.join()
+                workers[i] = new_worker()
+
+        for i, worker in enumerate(workers):
+            if worker in dead:
+                if worker.filename is not None:
+                    fail(worker.filename, f"Worker exited with code {worker.process.exitcode}")
+            elif worker.filename is not None and args.doc_timeout and time.monotonic() - worker.started > args.doc_timeout:
+                worker.process.kill()
+                fail(worker.filename, f"Timeout: parsing took longer than {args.doc_timeout} seconds")
+            else:
+                continue
+            worker.process.join()
+            workers[i] = new_worker()
+
+    for worker in workers:
+        worker.stop()
+    progress.close()
+    return failures
+
+def save_failures(failures, args):
+    """
+    Saves the quarantine list of the current run to the output directory, one JSON record per line, or
+    removes the list of a previous run if no file failed.
+
+    Arguments:
+        failures (dict): failure records by file name
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        None
+    """
+    failures_fpath = os.path.join(args.output_directory, failures_filename)
+    if not failures:
+        if os.path.exists(failures_fpath):
+            os.remove(failures_fpath)
+        return
+    with atomic_path(failures_fpath) as temp_fpath:
+        with io.open(temp_fpath, 'w', encoding='utf-8') as f:
+            for filename in sorted(failures):
+                f.write(json.dumps(failures[filename], ensure_ascii=False) + '\n')
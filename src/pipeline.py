@@ -3,48 +3,67 @@ import os
 import re
 from tqdm import tqdm
 import spacy
-from main02_parse_articles import parse_article
+from main02_parse_articles import parse_articles, parse_shard
 from main03_get_parse_data import extract_pdata
-from main04_compute_auth import combine_auth, compute_statement_auth
+from main04_compute_auth import combine_auth, compute_auth_chunks, find_changed_auth_inputs, iter_auth_chunks, \
+	lexicon_filename, list_auth_chunks, load_auth, save_auth_fingerprint, subnorm_dtype, unpack_flags
+from scheduler import Scheduler, Stage
+from sketches import SpaceSaving, save_sketches, sketches_filename
+from vocab import get_categorical_memory, report_memory_saved
 import pandas as pd
 import numpy as np
 
 # commands to run the file in the terminal
 # python src/pipeline.py --input_directory cleaned_cbas --output_directory output
 # python src/pipeline.py --input_directory cleaned_cbas_clause --output_directory output --clause
+# python src/pipeline.py --input_directory cleaned_cbas --output_directory output --pipe --batch_size 50 --n_process 32
+# python src/pipeline.py --input_directory cleaned_cbas --output_directory output --rescore
+# python src/pipeline.py --input_directory cleaned_cbas --output_directory output --from auth --until aggregate
 
 pd.options.mode.chained_assignment = None
 
+# provision types and sub-types reported with the subject verb prefixes
+prefix_provisions = ['obligation', 'constraint', 'permission', 'entitlement', 'other_provision', 'obligation_1',
+	'obligation_2', 'constraint_1', 'constraint_2', 'constraint_3', 'permission_1', 
+	'permission_2', 'permission_3', 'entitlement_1', 'entitlement_2', 'entitlement_3']
+prefix_columns = prefix_provisions + ['vlem', 'neg', 'subject', 'modal', 'helping_verb', 'verb', 'subnorm']
+
 class Pipeline():
 	def __init__(self, args):
 		self.args = args
 		os.makedirs(self.args.output_directory, exist_ok=True)
-		self.nlp = spacy.load('pt_core_news_sm', disable=["ner"])
+		# the model is loaded when articles are parsed, so that runs that do not parse do not load it
+		self.nlp = None
 
 	def parse_articles(self):
-		for filename in tqdm(os.listdir(args.input_directory)):
-			parse_article(filename, self.nlp, self.args)
+		if self.nlp is None:
+			self.nlp = spacy.load('pt_core_news_sm', disable=["ner"])
+		parse_articles(os.listdir(self.args.input_directory), self.nlp, self.args)
 
 	def extract_parsed_data(self):
 		extract_pdata(self.args)
 
 	def compute_authority_measures(self):
-		chunks = os.listdir(os.path.join(self.args.output_directory, "03_pdata"))
-		chunks = sorted(chunks, key=lambda x: int(x.split("_")[-1][:-4]))
-		for filename in tqdm(chunks):
-			filepath = os.path.join(self.args.output_directory, "03_pdata", filename)
-			cur_df = pd.read_pickle(filepath)
-			compute_statement_auth(self.args, cur_df, filename)
+		compute_auth_chunks(self.args)
 		combine_auth(self.args)
+		save_auth_fingerprint(self.args)
 
 	def determine_subject_verb_prefixes(self):
-		df = pd.read_pickle(os.path.join(self.args.output_directory, "04_auth.pkl"))
+		if self.args.prefix_mode == "grouped":
+			self.count_subject_verb_prefixes()
+			return
+		if self.args.prefix_mode == "sketch":
+			self.sketch_subject_verb_prefixes()
+			return
+
+		provisions = prefix_provisions
+		df = load_auth(self.args, provisions + ['vlem', 'neg', 'subject', 'modal', 'helping_verb', 'verb', 'subnorm'])
+		if 'flags' in df:
+			# expands only the flags used here from the packed flags
+			df = pd.concat([df.drop(columns='flags'), unpack_flags(df, ['neg'] + provisions)], axis=1)
 		df_prefixes = df[['obligation', 'constraint', 'permission', 'entitlement', 'other_provision', 'vlem', 
 		    'obligation_1', 'obligation_2', 'constraint_1', 'constraint_2', 'constraint_3', 'permission_1', 
 			'permission_2', 'permission_3', 'entitlement_1', 'entitlement_2', 'entitlement_3']]
-		provisions = ['obligation', 'constraint', 'permission', 'entitlement', 'other_provision', 'obligation_1',
-			'obligation_2', 'constraint_1', 'constraint_2', 'constraint_3', 'permission_1', 
-			'permission_2', 'permission_3', 'entitlement_1', 'entitlement_2', 'entitlement_3']
 		df_prefixes[provisions] = df_prefixes[provisions].astype(int)
 		
 		# replaces boolean values with text
@@ -58,8 +77,8 @@ class Pipeline():
 		)
 		df_prefixes['subject_verb_prefix'] = [re.sub(' +', ' ', x.lower().strip()) for x in prefix_components]
 
-		# creates dummy variables for agents
-		subject_df = pd.get_dummies(df['subnorm'])
+		# creates dummy variables for agents (only those that occur, as when 'subnorm' held strings)
+		subject_df = pd.get_dummies(df['subnorm'].astype('category').cat.remove_unused_categories())
 		df_prefixes = pd.concat([df_prefixes, subject_df], axis=1)
 
 		# counts and sorts subject verb prefixes
@@ -78,18 +97,132 @@ class Pipeline():
 		df_manager = df_prefixes[df_prefixes['manager'] == 1].head(5000)
 		df_manager.to_csv(os.path.join(self.args.output_directory, "05_manager_subject_verb_prefixes.csv"), index=False)
 
-	def aggregate_measures(self):
-		df = pd.read_pickle(os.path.join(self.args.output_directory, "04_auth.pkl"))		
-		if self.args.clause:
-			to_keep = ['contract_id', 'clause_name', 'md', 'passive', 'neg', 'strict_modal', 'permissive_modal', 'obligation_verb', 
-	     	'constraint_verb', 'permission_verb', 'entitlement_verb', 'promise_verb', 'special_verb', 'active_verb', 
-			'obligation', 'constraint', 'permission', 'entitlement', 'other_provision', 'subnorm']
+	def form_subject_verb_prefixes(self, df):
+		# forms each distinct prefix once, from the first statement with each combination of its components
+		components = ['subject', 'neg', 'modal', 'helping_verb', 'verb']
+		combination_codes = df.groupby(components, sort=False, observed=True, dropna=False).ngroup().to_numpy()
+		combinations = df[components].drop_duplicates()
+		combinations = {column: combinations[column].astype(str).to_numpy(dtype=object) for column in components}
+		neg = np.where(combinations['neg'] == 'True', 'não', '')
+		prefix_components = np.where(
+			combinations['subject'] == 'se',
+			neg + ' ' + combinations['subject'] + ' ' + combinations['modal'] + ' ' + combinations['helping_verb'] + ' ' + combinations['verb'],
+			combinations['subject'] + ' ' + neg + ' ' + combinations['modal'] + ' ' + combinations['helping_verb'] + ' ' + combinations['verb']
+		)
+		prefixes = pd.Series(prefix_components, dtype=object).str.lower().str.strip().str.replace(' +', ' ', regex=True)
+		# different combinations can form the same prefix, e.g. with and without a helping verb
+		prefix_codes, prefix_values = pd.factorize(prefixes)
+		return prefix_codes[combination_codes], prefix_values
+
+	def count_prefixes_by_agent(self, df, statement_prefixes):
+		# counts statements and sums provisions by prefix code and agent
+		counts = pd.concat([df[prefix_provisions].astype(int), df['subnorm']], axis=1)
+		counts['prefix'] = statement_prefixes
+		return counts.groupby(['prefix', 'subnorm'], observed=True).agg(
+			**{column: (column, 'sum') for column in prefix_provisions}, count=('prefix', 'size'))
+
+	def load_prefix_columns(self, df):
+		# expands only the flags used for the prefixes from the packed flags
+		if 'flags' in df:
+			df = pd.concat([df.drop(columns='flags'), unpack_flags(df, ['neg'] + prefix_provisions)], axis=1)
+		return df
+
+	def count_subject_verb_prefixes(self):
+		provisions = prefix_provisions
+		df = self.load_prefix_columns(load_auth(self.args, prefix_columns))
+		statement_prefixes, prefix_values = self.form_subject_verb_prefixes(df)
+		counts = self.count_prefixes_by_agent(df, statement_prefixes)
+		agent_counts = counts['count'].unstack('subnorm', fill_value=0)
+
+		# the verb lemma of the first statement with each prefix
+		_, first_statements = np.unique(statement_prefixes, return_index=True)
+		vlem = df['vlem'].to_numpy()[first_statements]
+
+		# ranks prefixes alphabetically, to order prefixes with the same count
+		prefix_ranks = np.empty(len(prefix_values), dtype=np.int64)
+		prefix_ranks[np.argsort(prefix_values.astype(str), kind='stable')] = np.arange(len(prefix_values))
+
+		def top_prefixes(totals, k):
+			# the k most frequent prefixes, ordered by count and then alphabetically
+			order = np.lexsort((prefix_ranks[totals.index.to_numpy()], -totals['count'].to_numpy()))[:k]
+			totals = totals.iloc[order]
+			table = totals[provisions[:5]]
+			table.insert(5, 'vlem', vlem[totals.index.to_numpy()])
+			table = pd.concat([table, totals[provisions[5:]]], axis=1)
+			table['subject_verb_prefix'] = prefix_values[totals.index.to_numpy()]
+			table = pd.concat([table, agent_counts.reindex(totals.index)], axis=1)
+			table['count'] = totals['count']
+			return table
+
+		# saves the most frequent prefixes overall and for each agent type
+		df_prefixes = top_prefixes(counts.groupby(level='prefix').sum(), 10000)
+		df_prefixes.to_csv(os.path.join(self.args.output_directory, "05_subject_verb_prefixes.csv"), index=False)
+		for agent in ['worker', 'firm', 'union', 'manager']:
+			agent_totals = counts.xs(agent, level='subnorm') if agent in agent_counts else counts.iloc[:0].droplevel('subnorm')
+			df_agent = top_prefixes(agent_totals, 5000)
+			df_agent.to_csv(os.path.join(self.args.output_directory, f"05_{agent}_subject_verb_prefixes.csv"), index=False)
+
+	def sketch_subject_verb_prefixes(self):
+		# approximate counts of the prefixes overall and for each agent type, from one authority data chunk at a time
+		agents = ['worker', 'firm', 'union', 'manager']
+		all_agents = [str(agent) for agent in subnorm_dtype.categories]
+		sketches = {name: SpaceSaving(self.args.sketch_capacity, prefix_provisions + all_agents, ['vlem'])
+			for name in ['all'] + agents}
+		for chunk in tqdm(iter_auth_chunks(self.args, prefix_columns), total=len(list_auth_chunks(self.args))):
+			if len(chunk) == 0:
+				continue
+			chunk = self.load_prefix_columns(chunk)
+			statement_prefixes, prefix_values = self.form_subject_verb_prefixes(chunk)
+			counts = self.count_prefixes_by_agent(chunk, statement_prefixes)
+			agent_counts = counts['count'].unstack('subnorm', fill_value=0)
+			agent_counts.columns = agent_counts.columns.astype(str)
+			agent_counts = agent_counts.reindex(columns=all_agents, fill_value=0)
+			# the verb lemma of the first statement with each prefix in the chunk
+			_, first_statements = np.unique(statement_prefixes, return_index=True)
+			vlem = pd.Series(chunk['vlem'].to_numpy(dtype=object)[first_statements], name='vlem')
+
+			totals = pd.concat([counts.groupby(level='prefix').sum(), agent_counts, vlem], axis=1, join='inner')
+			totals.index = prefix_values[totals.index.to_numpy()]
+			sketches['all'].update(totals)
+			chunk_agents = counts.index.unique(level='subnorm')
+			for agent in agents:
+				if agent in chunk_agents:
+					totals = counts.xs(agent, level='subnorm')
+					totals = pd.concat([totals, agent_counts.loc[totals.index], vlem.loc[totals.index]], axis=1)
+					totals.index = prefix_values[totals.index.to_numpy()]
+					sketches[agent].update(totals)
+
+		save_sketches(sketches, os.path.join(self.args.output_directory, sketches_filename))
+		self.save_sketched_prefixes(sketches)
+
+	def save_sketched_prefixes(self, sketches):
+		# saves the prefixes with the largest approximate counts, with the maximum overestimate of each count
+		for name, k in [('all', 10000), ('worker', 5000), ('firm', 5000), ('union', 5000), ('manager', 5000)]:
+			top = sketches[name].top(k)
+			# same columns as the other prefix modes, with the maximum overestimate of each count
+			table = top[prefix_provisions[:5] + ['vlem'] + prefix_provisions[5:]]
+			table['subject_verb_prefix'] = top.index
+			table = pd.concat([table, top[top.columns.difference(prefix_provisions + ['vlem', 'count', 'error'], sort=False)]], axis=1)
+			table['count'] = top['count']
+			table['count_error'] = top['error']
+			filename = "05_subject_verb_prefixes.csv" if name == 'all' else f"05_{name}_subject_verb_prefixes.csv"
+			table.to_csv(os.path.join(self.args.output_directory, filename), index=False)
+			print(f"{filename}: counts overestimated by at most {int(top['error'].max()) if len(top) else 0}, "
+				f"unlisted prefixes occur at most {sketches[name].bound} times")
+
+	def select_measures(self, df, keys, measures):
+		# keeps the keys, measures and agent of each statement, with the number of statements each row stands for
+		if 'flags' in df:
+			# statements with the same packed flags are counted together, and their flags are tested once
+			df = df.groupby(keys + ['flags', 'subnorm'], as_index=False, observed=True).size()
+			weights = df.pop('size')
+			df = pd.concat([df[keys], unpack_flags(df, measures).mul(weights, axis=0), df['subnorm']], axis=1)
 		else:
-			to_keep = ['contract_id', 'md', 'passive', 'neg', 'strict_modal', 'permissive_modal', 'obligation_verb', 
-	     	'constraint_verb', 'permission_verb', 'entitlement_verb', 'promise_verb', 'special_verb', 'active_verb', 
-			'obligation', 'constraint', 'permission', 'entitlement', 'other_provision', 'subnorm']
-		df = df[to_keep]
+			df = df[keys + measures + ['subnorm']]
+			weights = 1
+		return df, weights
 
+	def sum_measures(self, df, weights, keys):
 		subjects = ['worker', 'firm', 'union', 'manager']
 		statements = ['obligation', 'constraint', 'permission', 'entitlement']
 
@@ -98,22 +231,43 @@ class Pipeline():
 			df[cur_measure] = df[cur_measure].astype(float)
 			for cur_subnorm in subjects:
 				new_col_name = cur_measure + "_" + cur_subnorm
-				df[new_col_name] = [(1 * i) if j == cur_subnorm else (0 * i) for i, j in zip(df[cur_measure], df["subnorm"])]
+				df[new_col_name] = df[cur_measure] * (df["subnorm"] == cur_subnorm)
 		
 		# adds subnorm counts
 		all_subjects = ['worker', 'firm', 'union', 'manager', 'other_agent']
 		for cur_subnorm in all_subjects:
-			df[cur_subnorm + "_count"] = [1 if i == cur_subnorm else 0 for i in df["subnorm"]]
+			df[cur_subnorm + "_count"] = weights * (df["subnorm"] == cur_subnorm).astype(int)
 
 		# removes the 'subnorm' column
 		df.drop("subnorm", axis=1, inplace=True)
 
-		# creates statement count, sums by contract ID, and cleans contract ID
-		df["num_statements"] = [1] * len(df)
-		if self.args.clause:
-			df = df.groupby(["contract_id", "clause_name"], as_index=False).sum()
+		# creates statement count and sums by contract ID (and clause name)
+		df["num_statements"] = weights
+		return df.groupby(keys, as_index=False, observed=True).sum()
+
+	def aggregate_measures(self):
+		keys = ['contract_id', 'clause_name'] if self.args.clause else ['contract_id']
+		measures = ['md', 'passive', 'neg', 'strict_modal', 'permissive_modal', 'obligation_verb', 
+			'constraint_verb', 'permission_verb', 'entitlement_verb', 'promise_verb', 'special_verb', 'active_verb', 
+			'obligation', 'constraint', 'permission', 'entitlement', 'other_provision']
+		if self.args.stream_aggregate:
+			# sums each authority data chunk separately and then sums the partial sums, so that memory depends on
+			# the number of contracts rather than on the number of statements
+			partial_sums = []
+			categorical_bytes, object_bytes = 0, 0
+			for chunk in tqdm(iter_auth_chunks(self.args, keys + measures + ['subnorm']), total=len(list_auth_chunks(self.args))):
+				if len(chunk) == 0:
+					continue
+				chunk, weights = self.select_measures(chunk, keys, measures)
+				chunk_bytes = get_categorical_memory(chunk)
+				categorical_bytes, object_bytes = categorical_bytes + chunk_bytes[0], object_bytes + chunk_bytes[1]
+				partial_sums.append(self.sum_measures(chunk, weights, keys))
+			report_memory_saved("05_aggregated input", categorical_bytes, object_bytes)
+			df = pd.concat(partial_sums).groupby(keys, as_index=False, observed=True).sum()
 		else:
-			df = df.groupby("contract_id", as_index=False).sum()
+			df, weights = self.select_measures(load_auth(self.args, keys + measures + ['subnorm']), keys, measures)
+			report_memory_saved("05_aggregated input", *get_categorical_memory(df))
+			df = self.sum_measures(df, weights, keys)
 
 		# converts values to integers
 		if self.args.clause:
@@ -125,21 +279,60 @@ class Pipeline():
 		# saves DataFrame as a CSV without indices
 		df.to_csv(os.path.join(self.args.output_directory, "05_aggregated.csv"), index=False)
 
-	def run_main(self):
-		# dependency parsing
-		os.makedirs(os.path.join(self.args.output_directory, "02_parsed_articles"), exist_ok=True)
-		self.parse_articles()
+	def rescore(self):
+		# recomputes the authority measures from the parsed data of an earlier run, leaving stages 02 and 03 untouched
+		pdata_directory = os.path.join(self.args.output_directory, "03_pdata")
+		if not os.path.isdir(pdata_directory) or not os.listdir(pdata_directory):
+			raise FileNotFoundError(f"--rescore needs the parsed data of an earlier run in {pdata_directory}")
+		os.makedirs(os.path.join(self.args.output_directory, "04_auth"), exist_ok=True)
 
-		# extract necessary parsed information
-		os.makedirs(os.path.join(self.args.output_directory, "03_pdata"), exist_ok=True)
-		self.extract_parsed_data()
+		# runs the stages from auth through the scheduler, so that the state of the pipeline records them, with
+		# auth only if its inputs changed and the 05 outputs always
+		stages = [stage for stage in self.get_stages() if stage.name not in ["parse", "extract"]]
+		for stage in stages:
+			stage.force = stage.name != "auth"
+		Scheduler(stages, self.args.output_directory).run()
 
-		os.makedirs(os.path.join(self.args.output_directory, "04_auth"), exist_ok=True)
+	def get_stages(self):
+		# declares the stages with the files and directories they read and write, the code they run, and the settings
+		# that change their outputs
+		output = lambda *names: [os.path.join(self.args.output_directory, name) for name in names]
+		source = lambda *names: [os.path.join(os.path.dirname(os.path.abspath(__file__)), name) for name in names]
+		settings = lambda *names: {name: getattr(self.args, name) for name in names}
+		agents = ['worker', 'firm', 'union', 'manager']
+		parse_outputs = output("02_parsed_articles", "02_manifest.json") + (output("02_docs") if self.args.save_docs else [])
+		auth_outputs = output("04_auth") if self.args.skip_auth_combine else output("04_auth", "04_auth.pkl")
+		prefix_outputs = output("05_subject_verb_prefixes.csv", *[f"05_{agent}_subject_verb_prefixes.csv" for agent in agents])
+		return [
+			Stage("parse", self.parse_articles, [self.args.input_directory], parse_outputs,
+				source("main02_parse_articles.py", "parse_workers.py", "parse_cache.py", "lemma_cache.py", "columnar.py"),
+				settings("clause", "rule_engine", "parsed_format", "max_chars", "shard", "save_docs"), force=self.args.force),
+			Stage("extract", self.extract_parsed_data, output("02_parsed_articles"), output("03_pdata", "03_vocab.json"),
+				source("main03_get_parse_data.py", "columnar.py", "vocab.py"),
+				settings("clause", "parsed_format", "pdata_format", "row_group_size")),
+			Stage("auth", self.compute_authority_measures, output("03_pdata", "03_vocab.json"), auth_outputs,
+				source("main04_compute_auth.py", "vocab.py") + [self.args.lexicon or lexicon_filename],
+				settings("clause", "pdata_format", "pack_flags", "skip_auth_combine"),
+				changed=lambda: find_changed_auth_inputs(self.args)),
+			Stage("prefixes", self.determine_subject_verb_prefixes, auth_outputs, prefix_outputs,
+				source("pipeline.py", "main04_compute_auth.py", "sketches.py"),
+				settings("clause", "prefix_mode", "sketch_capacity")),
+			Stage("aggregate", self.aggregate_measures, auth_outputs, output("05_aggregated.csv"),
+				source("pipeline.py", "main04_compute_auth.py"),
+				settings("clause", "stream_aggregate")),
+		]
+
+	def run_main(self):
+		if self.args.rescore:
+			self.rescore()
+			return
+
+		for directory in ["02_parsed_articles", "03_pdata", "04_auth"]:
+			os.makedirs(os.path.join(self.args.output_directory, directory), exist_ok=True)
 
-		# compute authority measures for chunks
-		self.compute_authority_measures()
-		self.determine_subject_verb_prefixes()
-		self.aggregate_measures()
+		# runs the stages that are not up to date, the prefixes and the aggregation together
+		scheduler = Scheduler(self.get_stages(), self.args.output_directory)
+		scheduler.run(self.args.from_stage, self.args.until_stage)
 		
 
 if __name__ == "__main__":
@@ -147,6 +340,38 @@ if __name__ == "__main__":
 	parser.add_argument("--input_directory", type=str, default="sample_data")
 	parser.add_argument("--output_directory", type=str, default="output_sample_data")
 	parser.add_argument("--clause", action='store_true')
+	parser.add_argument("--pipe", action='store_true')
+	parser.add_argument("--batch_size", type=int, default=50)
+	parser.add_argument("--n_process", type=int, default=1)
+	parser.add_argument("--force", action='store_true')
+	parser.add_argument("--lemma_cache", type=str, default="")
+	parser.add_argument("--lemma_cache_size", type=int, default=100000)
+	parser.add_argument("--save_docs", action='store_true')
+	parser.add_argument("--reuse_parses", action='store_true')
+	parser.add_argument("--rule_engine", type=str, default="token", choices=["token", "array", "check"])
+	parser.add_argument("--parsed_format", type=str, default="pkl", choices=["pkl", "arrow"])
+	parser.add_argument("--max_chars", type=int, default=100000)
+	parser.add_argument("--isolate", action="store_true")
+	parser.add_argument("--doc_timeout", type=float, default=600)
+	parser.add_argument("--max_memory_mb", type=int, default=0)
+	parser.add_argument("--max_retries", type=int, default=1)
+	parser.add_argument("--resume", action='store_true')
+	parser.add_argument("--shard", type=parse_shard, default=None)
+	parser.add_argument("--pdata_format", type=str, default="pkl", choices=["pkl", "parquet"])
+	parser.add_argument("--row_group_size", type=int, default=100000)
+	parser.add_argument("--jobs", type=int, default=1)
+	parser.add_argument("--legacy_auth", action='store_true')
+	parser.add_argument("--pack_flags", action='store_true')
+	parser.add_argument("--skip_auth_combine", action='store_true')
+	parser.add_argument("--lexicon", type=str, default="")
+	parser.add_argument("--keyed_auth", action='store_true')
+	parser.add_argument("--rescore", action='store_true')
+	parser.add_argument("--stream_aggregate", action='store_true')
+	parser.add_argument("--prefix_mode", type=str, default="legacy", choices=["legacy", "grouped", "sketch"])
+	parser.add_argument("--sketch_capacity", type=int, default=50000)
+	stage_names = ["parse", "extract", "auth", "prefixes", "aggregate"]
+	parser.add_argument("--from", dest="from_stage", type=str, default=None, choices=stage_names)
+	parser.add_argument("--until", dest="until_stage", type=str, default=None, choices=stage_names)
 	args = parser.parse_args()
 	pipeline = Pipeline(args)
 	pipeline.run_main()
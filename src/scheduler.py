@@ -0,0 +1,233 @@
+import hashlib
+import io
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+from atomic_io import atomic_path
+
+# state of the stages of the last runs, stored in the output directory
+state_filename = "pipeline_state.json"
+
+class Stage():
+    """
+    Step of the pipeline, declared with the files and directories it reads and writes. A stage depends on the
+    stages that write its inputs. A stage that also tracks its inputs itself declares a function giving the
+    names of the inputs that changed since its outputs were written, so that outputs written outside of the
+    scheduler are not taken as up to date.
+    """
+    def __init__(self, name, run, inputs, outputs, code=(), settings=None, force=False, changed=None):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.code = list(code)
+        self.settings = settings or {}
+        self.force = force
+        self.changed = changed
+
+    def fingerprint(self):
+        """
+        Fingerprints the code and settings of the stage.
+
+        Returns:
+            str, hexadecimal digest of the contents of the code files and of the settings
+        """
+        sha = hashlib.sha256()
+        for filepath in self.code:
+            with open(filepath, 'rb') as f:
+                sha.update(f.read())
+        sha.update(json.dumps(self.settings, sort_keys=True, default=str).encode('utf-8'))
+        return sha.hexdigest()
+
+def get_modified_time(path):
+    """
+    Finds when a file, or a directory or any of the files in it, was last modified.
+
+    Arguments:
+        path (str): path of the file or directory
+
+    Returns:
+        float, modification time in seconds since the epoch, or None if the path does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    modified = os.path.getmtime(path)
+    if os.path.isdir(path):
+        with os.scandir(path) as entries:
+            modified = max([modified] + [entry.stat().st_mtime for entry in entries])
+    return modified
+
+class Scheduler():
+    """
+    Runs the stages of the pipeline in dependency order, skipping the stages that are up to date: their outputs
+    exist, their inputs have not changed since they last started, and their code and settings are unchanged.
+    Stages whose dependencies are done run together, in separate processes where they can be forked.
+    """
+    def __init__(self, stages, output_directory):
+        self.stages = stages
+        self.state_fpath = os.path.join(output_directory, state_filename)
+
+    def get_dependencies(self, stage):
+        """
+        Finds the stages that write the inputs of a stage.
+
+        Arguments:
+            stage (Stage): stage of the pipeline
+
+        Returns:
+            list of stage names
+        """
+        return [other.name for other in self.stages
+                if other is not stage and any(path in other.outputs for path in stage.inputs)]
+
+    def load_state(self):
+        """
+        Loads the state of the stages of the last runs.
+
+        Returns:
+            dictionary with the fingerprint and start time of each stage that completed
+        """
+        if not os.path.exists(self.state_fpath):
+            return {}
+        with io.open(self.state_fpath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_state(self, state):
+        """
+        Saves the state of the stages.
+
+        Arguments:
+            state (dict): fingerprint and start time of each stage that completed
+
+        Returns:
+            None
+        """
+        with atomic_path(self.state_fpath) as temp_fpath:
+            with io.open(temp_fpath, 'w', encoding='utf-8') as f:
+                json.dump(state, f, indent=1, sort_keys=True)
+
+    def is_fresh(self, stage, state):
+        """
+        Checks whether a stage is up to date.
+
+        Arguments:
+            stage (Stage): stage of the pipeline
+            state (dict): state of the stages of the last runs
+
+        Returns:
+            bool
+        """
+        last_run = state.get(stage.name)
+        if stage.force or last_run is None or last_run['fingerprint'] != stage.fingerprint():
+            return False
+        if any(not os.path.exists(path) for path in stage.outputs):
+            return False
+        input_times = [get_modified_time(path) for path in stage.inputs]
+        if not all(modified is not None and modified < last_run['started'] for modified in input_times):
+            return False
+        changed = stage.changed() if stage.changed is not None else []
+        if changed:
+            print(f"Stage {stage.name} inputs changed: {', '.join(changed)}")
+        return not changed
+
+    def select(self, from_stage=None, until_stage=None):
+        """
+        Selects the stages from from_stage to until_stage, in the order they are declared.
+
+        Arguments:
+            from_stage (str): name of the first stage, or None to start with the first stage
+            until_stage (str): name of the last stage, or None to end with the last stage
+
+        Returns:
+            list of Stage
+        """
+        names = [stage.name for stage in self.stages]
+        first = names.index(from_stage) if from_stage else 0
+        last = names.index(until_stage) if until_stage else len(names) - 1
+        return self.stages[first:last + 1]
+
+    def run(self, from_stage=None, until_stage=None):
+        """
+        Runs the selected stages that are not up to date. With from_stage, the selected stages run even if
+        they are up to date.
+
+        Arguments:
+            from_stage (str): name of the first stage to run, or None
+            until_stage (str): name of the last stage to run, or None
+
+        Returns:
+            None
+        """
+        selected = self.select(from_stage, until_stage)
+        selected_names = {stage.name for stage in selected}
+        state = self.load_state()
+        done = set()
+        while len(done) < len(selected):
+            # stages whose selected dependencies are done
+            ready = [stage for stage in selected if stage.name not in done
+                     and all(name in done or name not in selected_names for name in self.get_dependencies(stage))]
+            stale = []
+            for stage in ready:
+                if from_stage is None and self.is_fresh(stage, state):
+                    print(f"Stage {stage.name} is up to date")
+                else:
+                    stale.append(stage)
+
+            self.run_stages(stale, state)
+            done.update(stage.name for stage in ready)
+
+    def save_completed(self, stage, state, started):
+        """
+        Records that a stage completed and saves the state, so that a later failure does not run it again.
+
+        Arguments:
+            stage (Stage): stage that completed
+            state (dict): state of the stages, updated in place
+            started (float): time the stage started
+
+        Returns:
+            None
+        """
+        state[stage.name] = {'fingerprint': stage.fingerprint(), 'started': started}
+        self.save_state(state)
+
+    def run_stages(self, stages, state):
+        """
+        Runs stages whose dependencies are done, each in a forked process if there are several. The state of
+        each stage is saved as soon as it completes, even if another stage fails.
+
+        Arguments:
+            stages (list): stages to run
+            state (dict): state of the stages, updated in place
+
+        Returns:
+            None
+        """
+        started = time.time()
+        if len(stages) < 2 or 'fork' not in multiprocessing.get_all_start_methods():
+            for stage in stages:
+                print(f"Running stage {stage.name}")
+                stage.run()
+                self.save_completed(stage, state, started)
+            return
+
+        context = multiprocessing.get_context('fork')
+        running = {}
+        for stage in stages:
+            print(f"Running stage {stage.name}")
+            process = context.Process(target=stage.run)
+            process.start()
+            running[process.sentinel] = (stage, process)
+        failed = set()
+        while running:
+            for sentinel in multiprocessing.connection.wait(list(running)):
+                stage, process = running.pop(sentinel)
+                process.join()
+                if process.exitcode == 0:
+                    self.save_completed(stage, state, started)
+                else:
+                    failed.add(stage.name)
+        if failed:
+            raise RuntimeError(f"Stages failed: {', '.join(stage.name for stage in stages if stage.name in failed)}")
@@ -0,0 +1,180 @@
+import io
+import json
+import numpy as np
+import pandas as pd
+from atomic_io import atomic_path
+
+# sketches of the subject verb prefixes, stored in the output directory so that the sketches of shards can be merged
+sketches_filename = "05_prefix_sketches.json"
+
+class SpaceSaving():
+    """
+    Space-Saving summary of the most frequent items of a stream (Metwally et al., 2005). At most capacity items are
+    kept, each with an estimated count that overestimates its true count by at most its error, and any item that
+    is not kept occurs at most 'bound' times. Counts are added in batches of exact counts, and summaries are merged
+    in the same way (Agarwal et al., 2012), so the summaries of shards of a corpus can be combined.
+
+    Each item also carries payload sums (e.g. numbers of obligations), which only include the batches added while
+    the item was kept, so they are lower bounds, and labels (e.g. a representative verb lemma), which are kept from
+    the first batch that added the item.
+    """
+    def __init__(self, capacity, payload_names=(), label_names=()):
+        self.capacity = capacity
+        self.payload_names = list(payload_names)
+        self.label_names = list(label_names)
+        columns = {column: pd.Series(dtype=np.int64) for column in ['count', 'error'] + self.payload_names}
+        columns.update((column, pd.Series(dtype=object)) for column in self.label_names)
+        self.table = pd.DataFrame(columns, index=pd.Index([], dtype=object))
+        self.bound = 0
+
+    def update(self, counts):
+        """
+        Adds a batch of exact counts.
+
+        Arguments:
+            counts (pandas.DataFrame): indexed by item, with a 'count' column, the payload columns, and the label
+                columns
+
+        Returns:
+            None
+        """
+        batch = counts[['count'] + self.payload_names].astype(np.int64)
+        batch.insert(1, 'error', 0)
+        for column in self.label_names:
+            batch[column] = counts[column].astype(object)
+        self.combine(batch, 0)
+
+    def merge(self, other):
+        """
+        Adds the counts of another summary with the same payload and label columns. The labels of this summary
+        are kept for the items of both.
+
+        Arguments:
+            other (SpaceSaving): summary to merge into this one
+
+        Returns:
+            None
+        """
+        self.combine(other.table, other.bound)
+
+    def combine(self, table, bound):
+        """
+        Combines the kept items with those of another table of counts. An item missing from one side may have
+        occurred up to that side's bound times, which is added to its count and error. Only the capacity items
+        with the largest counts are kept.
+
+        Arguments:
+            table (pandas.DataFrame): counts, errors, payload sums and labels, indexed by item
+            bound (int): maximum count of the items missing from table
+
+        Returns:
+            None
+        """
+        items = self.table.index.union(table.index, sort=False)
+        own = self.table.reindex(items)
+        other = table.reindex(items)
+        combined = pd.DataFrame(index=items)
+        for column, own_bound, other_bound in [('count', self.bound, bound), ('error', self.bound, bound)]:
+            combined[column] = own[column].fillna(own_bound) + other[column].fillna(other_bound)
+        for column in self.payload_names:
+            combined[column] = own[column].fillna(0) + other[column].fillna(0)
+        combined = combined.astype(np.int64)
+        for column in self.label_names:
+            combined[column] = own[column].combine_first(other[column]).astype(object)
+
+        dropped_bound = 0
+        if len(combined) > self.capacity:
+            combined = self.sort(combined)
+            dropped_bound = int(combined['count'].iloc[self.capacity])
+            combined = combined.iloc[:self.capacity]
+        self.table = combined
+        self.bound = max(self.bound + bound, dropped_bound)
+
+    @staticmethod
+    def sort(table):
+        """
+        Orders a table of counts by decreasing count, then by item.
+
+        Arguments:
+            table (pandas.DataFrame): counts indexed by item
+
+        Returns:
+            pandas.DataFrame
+        """
+        order = np.lexsort((table.index.to_numpy().astype(str), -table['count'].to_numpy()))
+        return table.iloc[order]
+
+    def top(self, k):
+        """
+        Lists the k items with the largest estimated counts.
+
+        Arguments:
+            k (int): number of items
+
+        Returns:
+            pandas.DataFrame indexed by item, with the estimated count, its error, the payload sums, and the labels
+        """
+        return self.sort(self.table).head(k)
+
+    def to_dict(self):
+        """
+        Converts the summary to a JSON-serializable dictionary.
+
+        Returns:
+            dict
+        """
+        counts = self.table[['count', 'error'] + self.payload_names]
+        labels = {column: self.table[column].where(self.table[column].notna(), None).tolist() for column in self.label_names}
+        return {'capacity': self.capacity, 'bound': self.bound, 'payload_names': self.payload_names,
+                'label_names': self.label_names, 'items': self.table.index.tolist(), 'counts': counts.to_numpy().tolist(),
+                'labels': labels}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuilds a summary converted with to_dict.
+
+        Arguments:
+            data (dict): summary as a dictionary
+
+        Returns:
+            SpaceSaving
+        """
+        sketch = cls(data['capacity'], data['payload_names'], data.get('label_names', []))
+        if data['items']:
+            index = pd.Index(data['items'], dtype=object)
+            sketch.table = pd.DataFrame(data['counts'], index=index, columns=['count', 'error'] + sketch.payload_names,
+                                        dtype=np.int64)
+            for column in sketch.label_names:
+                sketch.table[column] = pd.Series(data['labels'][column], index=index, dtype=object)
+        sketch.bound = data['bound']
+        return sketch
+
+def save_sketches(sketches, filepath):
+    """
+    Saves named summaries to a JSON file.
+
+    Arguments:
+        sketches (dict): SpaceSaving summaries by name
+        filepath (str): path of the JSON file
+
+    Returns:
+        None
+    """
+    # json.dumps encodes much faster than json.dump, which writes the summaries piece by piece
+    with atomic_path(filepath) as temp_fpath:
+        with io.open(temp_fpath, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({name: sketch.to_dict() for name, sketch in sketches.items()}, ensure_ascii=False))
+
+def load_sketches(filepath):
+    """
+    Loads named summaries saved with save_sketches.
+
+    Arguments:
+        filepath (str): path of the JSON file
+
+    Returns:
+        dictionary of SpaceSaving summaries by name
+    """
+    with io.open(filepath, 'r', encoding='utf-8') as f:
+        return {name: SpaceSaving.from_dict(data) for name, data in json.load(f).items()}
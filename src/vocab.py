@@ -0,0 +1,125 @@
+import io
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from atomic_io import atomic_path
+
+# vocabulary of the categorical columns of the parsed data, stored in the output directory
+vocab_filename = "03_vocab.json"
+
+def get_vocab_columns(clause):
+    """
+    Lists the parsed data columns that are stored as categoricals with a shared vocabulary.
+
+    Arguments:
+        clause (bool): whether the data includes the clause name
+
+    Returns:
+        list of column names
+    """
+    return ['vlem', 'slem', 'mlem', 'contract_id'] + (['clause_name'] if clause else [])
+
+def update_vocab(vocab, data):
+    """
+    Adds the values of the vocabulary columns of a chunk of parsed data to the vocabulary.
+
+    Arguments:
+        vocab (dict): sets of values by column name, updated in place
+        data: Pandas DataFrame or pyarrow.Table of parsed data
+
+    Returns:
+        None
+    """
+    for column, values in vocab.items():
+        if isinstance(data, pd.DataFrame):
+            if column in data:
+                values.update(data[column].dropna().unique())
+        elif column in data.column_names:
+            values.update(value for value in data.column(column).unique().to_pylist() if value is not None)
+
+def save_vocab(vocab, args):
+    """
+    Saves the vocabulary, with the values of each column sorted, to the output directory.
+
+    Arguments:
+        vocab (dict): sets of values by column name
+        args: object containing the required arguments and settings
+
+    Returns:
+        None
+    """
+    vocab_fpath = os.path.join(args.output_directory, vocab_filename)
+    with atomic_path(vocab_fpath) as temp_fpath:
+        with io.open(temp_fpath, 'w', encoding='utf-8') as f:
+            json.dump({column: sorted(values) for column, values in vocab.items()}, f, ensure_ascii=False)
+
+def load_vocab(args):
+    """
+    Loads the vocabulary saved by stage 03 as categorical dtypes.
+
+    Arguments:
+        args: object containing the required arguments and settings
+
+    Returns:
+        dictionary of pandas.CategoricalDtype by column name, empty if stage 03 saved no vocabulary
+    """
+    vocab_fpath = os.path.join(args.output_directory, vocab_filename)
+    if not os.path.exists(vocab_fpath):
+        return {}
+    with io.open(vocab_fpath, 'r', encoding='utf-8') as f:
+        return {column: pd.CategoricalDtype(values) for column, values in json.load(f).items()}
+
+def apply_vocab(df, vocab):
+    """
+    Converts the vocabulary columns of a DataFrame to categoricals with the shared categories, so that
+    chunks can be concatenated without losing their categorical dtypes.
+
+    Arguments:
+        df: Pandas DataFrame
+        vocab (dict): categorical dtypes by column name
+
+    Returns:
+        Pandas DataFrame
+    """
+    return df.astype({column: dtype for column, dtype in vocab.items() if column in df})
+
+def get_categorical_memory(df):
+    """
+    Measures the memory used by the categorical columns of a DataFrame, and the memory they would use as
+    object columns of strings (as measured by DataFrame.memory_usage(deep=True)).
+
+    Arguments:
+        df: Pandas DataFrame
+
+    Returns:
+        tuple of the number of bytes as categoricals and as objects
+    """
+    categorical_bytes = 0
+    object_bytes = 0
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            series = df[column]
+            categorical_bytes += series.memory_usage(deep=True, index=False)
+            codes = series.cat.codes.to_numpy()
+            # missing values have the code -1 and are counted with the size of NaN
+            counts = np.append(np.bincount(codes[codes >= 0], minlength=len(series.cat.categories)), (codes < 0).sum())
+            sizes = np.array([sys.getsizeof(value) for value in series.cat.categories] + [sys.getsizeof(np.nan)])
+            object_bytes += 8 * len(series) + int(sizes @ counts)
+    return categorical_bytes, object_bytes
+
+def report_memory_saved(stage, categorical_bytes, object_bytes):
+    """
+    Prints the memory saved by categorical columns.
+
+    Arguments:
+        stage (str): description of the stage
+        categorical_bytes (int): bytes used by the categorical columns
+        object_bytes (int): bytes the columns would use as object columns
+
+    Returns:
+        None
+    """
+    print(f"{stage}: categorical columns use {categorical_bytes / 2**20:.1f} MB instead of "
+          f"{object_bytes / 2**20:.1f} MB ({(object_bytes - categorical_bytes) / 2**20:.1f} MB saved)")
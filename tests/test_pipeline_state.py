@@ -0,0 +1,139 @@
+import argparse
+import io
+import json
+import os
+import sys
+
+import spacy
+from spacy.language import Language
+from spacy.tokens import DocBin
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+from lemma_cache import lemma_cache
+from main02_parse_articles import docs_output_path
+from main04_compute_auth import lexicon_filename
+from pipeline import Pipeline
+from scheduler import state_filename
+from synthetic_cbas import generate_corpus, get_se_lemmas
+
+# parsed documents of the synthetic corpus by text, returned by the synthetic parser instead of a spaCy model
+synthetic_docs = {}
+
+@Language.component("synthetic_parser")
+def synthetic_parser(doc):
+    return synthetic_docs.get(doc.text, doc)
+
+
+def get_args(tmp_path, **options):
+    """
+    Gives the command-line arguments of a pipeline run on the synthetic corpus, with the default settings.
+
+    Arguments:
+        tmp_path (pathlib.Path): directory of the corpus and of the outputs
+        options: settings that differ from the defaults
+
+    Returns:
+        argparse.Namespace
+    """
+    args = dict(input_directory=str(tmp_path / "input"), output_directory=str(tmp_path / "output"), clause=False,
+                pipe=False, batch_size=50, n_process=1, force=False, lemma_cache="", lemma_cache_size=100000,
+                save_docs=False, reuse_parses=False, rule_engine="token", parsed_format="pkl", max_chars=100000,
+                isolate=False, doc_timeout=600, max_memory_mb=0, max_retries=1, resume=False, shard=None,
+                pdata_format="pkl", row_group_size=100000, jobs=1, legacy_auth=False, pack_flags=False,
+                skip_auth_combine=False, lexicon="", keyed_auth=False, rescore=False, stream_aggregate=False,
+                prefix_mode="legacy", sketch_capacity=50000, from_stage=None, until_stage=None)
+    args.update(options)
+    return argparse.Namespace(**args)
+
+
+def run_pipeline(args):
+    """
+    Runs the pipeline with the synthetic parser.
+
+    Arguments:
+        args (argparse.Namespace): command-line arguments
+
+    Returns:
+        str, contents of 05_aggregated.csv
+    """
+    nlp = spacy.blank("pt")
+    nlp.add_pipe("synthetic_parser")
+    pipeline = Pipeline(args)
+    pipeline.nlp = nlp
+    pipeline.run_main()
+    with io.open(os.path.join(args.output_directory, "05_aggregated.csv"), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def make_corpus(tmp_path):
+    """
+    Writes a synthetic corpus to the input directory of the pipeline, and makes its parsed documents available
+    to the synthetic parser.
+
+    Arguments:
+        tmp_path (pathlib.Path): directory of the corpus and of the outputs
+
+    Returns:
+        list of the names of the contract files
+    """
+    corpus_args = argparse.Namespace(input_directory=str(tmp_path / "input"), output_directory=str(tmp_path / "corpus"),
+                                     docs=10, sentences=30, clause=False, save_docs=True, seed=0)
+    vocab = spacy.blank("pt").vocab
+    filenames = generate_corpus(corpus_args, vocab)
+    for filename in filenames:
+        for doc in DocBin().from_disk(docs_output_path(filename, corpus_args)).get_docs(vocab):
+            synthetic_docs[doc.text] = doc
+    lemma_cache.lemmas.update(get_se_lemmas())
+    return filenames
+
+
+def test_normal_run_after_rescore_recomputes_auth(tmp_path, capsys):
+    make_corpus(tmp_path)
+
+    # a lexicon without the entitlement verbs
+    with io.open(lexicon_filename, 'r', encoding='utf-8') as f:
+        lexicon = json.load(f)
+    lexicon['entitlement'] = {}
+    other_lexicon = str(tmp_path / "other_lexicon.json")
+    with io.open(other_lexicon, 'w', encoding='utf-8') as f:
+        json.dump(lexicon, f)
+
+    aggregated = run_pipeline(get_args(tmp_path))
+    rescored = run_pipeline(get_args(tmp_path, rescore=True, lexicon=other_lexicon))
+    assert rescored != aggregated
+    with io.open(os.path.join(tmp_path, "output", state_filename), 'r', encoding='utf-8') as f:
+        assert set(json.load(f)) == {"parse", "extract", "auth", "prefixes", "aggregate"}
+
+    capsys.readouterr()
+    assert run_pipeline(get_args(tmp_path)) == aggregated
+    output = capsys.readouterr().out
+    assert "Stage parse is up to date" in output
+    assert "Stage extract is up to date" in output
+    assert "Running stage auth" in output
+
+    # with the auth inputs unchanged since, the next run skips auth
+    run_pipeline(get_args(tmp_path))
+    assert "Stage auth is up to date" in capsys.readouterr().out
+
+
+def test_save_docs_reruns_parse(tmp_path, capsys):
+    filenames = make_corpus(tmp_path)
+    run_pipeline(get_args(tmp_path))
+    capsys.readouterr()
+
+    run_pipeline(get_args(tmp_path, save_docs=True))
+    assert "Running stage parse" in capsys.readouterr().out
+    # the files parsed by the first run are parsed again to save their documents
+    args = get_args(tmp_path)
+    assert all(os.path.exists(docs_output_path(filename, args)) for filename in filenames)
+    run_pipeline(get_args(tmp_path, save_docs=True))
+    assert "Stage parse is up to date" in capsys.readouterr().out
+
+
+def test_parse_summary_counts_quarantined_files_apart(tmp_path, capsys):
+    make_corpus(tmp_path)
+    with io.open(os.path.join(tmp_path, "input", "invalid_cleaned.txt"), 'wb') as f:
+        f.write(b"\xff\xfe invalid utf-8")
+    run_pipeline(get_args(tmp_path))
+    assert "10 parsed, 1 quarantined" in capsys.readouterr().out
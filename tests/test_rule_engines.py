@@ -0,0 +1,60 @@
+import argparse
+import os
+import sys
+
+import joblib
+import pytest
+import spacy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+from lemma_cache import lemma_cache
+from main02_parse_articles import parsed_output_path, reparse_article, sentence_counts
+from synthetic_cbas import generate_corpus, get_se_lemmas
+
+# the rule engines are run on the saved documents of a synthetic corpus, so that no spaCy model is needed
+
+
+def parse_corpus(filenames, nlp, args, rule_engine):
+    """
+    Reruns the parsing rules of stage 02 on the saved documents of a corpus with one of the rule engines.
+
+    Arguments:
+        filenames (list): names of the article files
+        nlp (spacy.Language): Spacy NLP model sharing the vocabulary of the saved documents
+        args (argparse.Namespace): command-line arguments
+        rule_engine (str): 'token', 'array', or 'check'
+
+    Returns:
+        dictionary of the statements of the parsed output file by file name, and the sentence pre-screen counts
+    """
+    args.rule_engine = rule_engine
+    sentence_counts.clear()
+    outputs = {}
+    for filename in filenames:
+        reparse_article(filename, nlp, args)
+        outputs[filename] = joblib.load(parsed_output_path(filename, args))
+    return outputs, dict(sentence_counts)
+
+
+@pytest.mark.parametrize("clause", [False, True])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_rule_engines_give_identical_outputs(tmp_path, clause, seed):
+    args = argparse.Namespace(input_directory=str(tmp_path / "input"), output_directory=str(tmp_path / "output"),
+                              docs=40, sentences=30, clause=clause, save_docs=True, seed=seed, parsed_format="pkl",
+                              max_chars=100000, rule_engine="token", resume=False)
+    filenames = generate_corpus(args)
+    os.makedirs(os.path.join(args.output_directory, "02_parsed_articles"))
+    nlp = spacy.blank("pt")
+    lemma_cache.lemmas.update(get_se_lemmas())
+
+    token_outputs, token_counts = parse_corpus(filenames, nlp, args, "token")
+    array_outputs, array_counts = parse_corpus(filenames, nlp, args, "array")
+    check_outputs, check_counts = parse_corpus(filenames, nlp, args, "check")
+
+    assert array_outputs == token_outputs
+    assert check_outputs == token_outputs
+    assert token_counts['sentences'] > 0
+    # the check engine counts each screened sentence once
+    assert array_counts == token_counts
+    assert check_counts == token_counts